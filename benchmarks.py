@@ -0,0 +1,1084 @@
+'''Benchmarks for final_project.py
+
+Run every benchmark, or one by name with its arguments, e.g.
+
+    python benchmarks.py
+    python benchmarks.py canonical_keys queries.log
+
+Every benchmark works on temporary files and never touches
+finalproject.sqlite or the API caches.
+
+The suite measures the program end to end without the network: Google
+Books, Wikipedia and the Elle page are served by a local stub server
+from the responses recorded in FIXTURES_DIR, or from synthetic ones
+for anything not recorded. Each run is appended to RESULTS_FILENAME
+and compared with the previous one:
+
+    python benchmarks.py record      # record fixtures, needs the API key
+    python benchmarks.py suite       # run and compare with the last run
+    python benchmarks.py suite ingest --results ingest.jsonl
+'''
+import argparse
+import contextlib
+import http.server
+import io
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs, urlsplit
+
+import final_project
+import queries
+
+SEARCH_TERMS = [
+    "Dune", "Harry Potter", "The Handmaid's Tale", "Ender's Game",
+    "Pride and Prejudice", "Sapiens", "Becoming", "Educated",
+    "Where the Crawdads Sing", "Charlotte's Web", "The Hobbit", "1984",
+    "Little Women", "Gone Girl", "Normal People", "The Vanishing Half",
+    "Children's books", "Science fiction", "Cooking", "History",
+]
+
+AUTHORS = [
+    ("Frank", "Herbert"), ("J.K.", "Rowling"), ("Margaret", "Atwood"),
+    ("Orson Scott", "Card"), ("Jane", "Austen"), ("Yuval Noah", "Harari"),
+    ("Michelle", "Obama"), ("Tara", "Westover"), ("J.R.R.", "Tolkien"),
+    ("Brit", "Bennett"), ("Sally", "Rooney"), ("Gillian", "Flynn"),
+]
+
+
+def term_stream(n, seed=507):
+    '''Builds a realistic stream of search terms: a few popular terms
+    searched over and over, a long tail searched once or twice, and
+    plenty of apostrophes
+
+    Parameters
+    ----------
+    n: int
+        the number of search terms
+    seed: int
+        the random seed, so runs are comparable
+
+    Returns
+    -------
+    list
+        the search terms
+    '''
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(len(SEARCH_TERMS))]
+    stream = []
+    for i in range(n):
+        if rng.random() < 0.3:
+            stream.append(f"{rng.choice(SEARCH_TERMS)} {rng.randrange(10000)}")
+        else:
+            stream.append(rng.choices(SEARCH_TERMS, weights)[0])
+    return stream
+
+
+def fill_books(terms, books_per_term=25):
+    '''Inserts books_per_term fake records for every search term'''
+    records = []
+    for term in terms:
+        for i in range(books_per_term):
+            records.append(final_project.BookRecord(
+                f"{term} {i}", None, "An Author", str(i), "Fiction", None,
+                4.0, i, term, f"{term}-{i}"))
+    final_project.insert_records_to_books(records)
+
+
+class StatementCacheStats:
+    '''Tracks how often a statement would be found in sqlite3's statement
+    cache, by replaying the SQL texts of a benchmark through an LRU of
+    the same size. sqlite3 does not expose its own counters
+
+    Parameters
+    ----------
+    size: int
+        the number of statements the cache holds
+    '''
+    def __init__(self, size=queries.STATEMENT_CACHE_SIZE):
+        self.size = size
+        self.lru = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, sql):
+        '''Counts one execution of sql as a cache hit or miss'''
+        if sql in self.lru:
+            self.hits += 1
+            self.lru.move_to_end(sql)
+        else:
+            self.misses += 1
+            self.lru[sql] = True
+            if len(self.lru) > self.size:
+                self.lru.popitem(last=False)
+
+    def hit_rate(self):
+        '''Returns the fraction of executions that hit the cache'''
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+def benchmark_statement_cache(n=20000):
+    '''Compares the old f-string SQL with the bound-parameter queries in
+    queries.py on a stream of search terms: statement cache hit rate,
+    time per query and queries broken by quotes in the term
+
+    Parameters
+    ----------
+    n: int
+        the number of queries to run
+
+    Returns
+    -------
+    dict
+        the results for the "fstring" and "bound" variants
+    '''
+    stream = term_stream(n)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        final_project.DB_SESSION = final_project.DatabaseSession(
+            os.path.join(tmp, "bench.sqlite"))
+        final_project.create_database()
+        session = final_project.get_db_session()
+        fill_books(SEARCH_TERMS)
+
+        stats = StatementCacheStats()
+        errors = 0
+        start = time.perf_counter()
+        for term in stream:
+            query = f'''
+    SELECT v.Title, v.Subtitle, v.Author, v.PublishedDate
+    FROM SearchVolumes sv JOIN Volumes v ON v.VolumeId = sv.VolumeId
+    WHERE sv.Keyword = '{term}'
+    ORDER BY sv.Rank
+'''
+            stats.record(query)
+            try:
+                session.fetchall(query)
+            except sqlite3.Error:
+                errors += 1
+        seconds = time.perf_counter() - start
+        results["fstring"] = {"hit_rate": stats.hit_rate(), "errors": errors,
+                              "us_per_query": seconds / n * 1e6}
+
+        stats = StatementCacheStats()
+        start = time.perf_counter()
+        for term in stream:
+            stats.record(queries.BOOKS_BY_KEYWORD)
+            session.fetchall(queries.BOOKS_BY_KEYWORD, (term,))
+        seconds = time.perf_counter() - start
+        results["bound"] = {"hit_rate": stats.hit_rate(), "errors": 0,
+                            "us_per_query": seconds / n * 1e6}
+
+        session.close()
+        final_project.DB_SESSION = None
+
+    for name, result in results.items():
+        print(f"{name:<8} hit rate {result['hit_rate']:6.1%}  "
+              f"{result['us_per_query']:7.1f} us/query  "
+              f"{result['errors']} broken queries")
+    return results
+
+
+def query_log(n, seed=507):
+    '''Builds a query log of search terms and author's names the way
+    users type them: random case, stray spaces, curly quotes and
+    "Last, First" names
+
+    Parameters
+    ----------
+    n: int
+        the number of queries
+    seed: int
+        the random seed, so runs are comparable
+
+    Returns
+    -------
+    list
+        (kind, query) tuples, kind is 'books' or 'wiki'
+    '''
+    rng = random.Random(seed)
+    log = []
+    for term in term_stream(n, seed):
+        if rng.random() < 0.3:
+            first, last = rng.choice(AUTHORS)
+            if rng.random() < 0.5:
+                query = f"{last}, {first}"
+            else:
+                query = f"{first} {last}"
+            if rng.random() < 0.3:
+                query = query.replace(". ", ".").replace(".", ". ")
+            kind = 'wiki'
+        else:
+            query = term
+            kind = 'books'
+        if rng.random() < 0.3:
+            query = query.upper() if rng.random() < 0.5 else query.lower()
+        if rng.random() < 0.2:
+            query = f" {query}  ".replace(" ", "  ", 1)
+        if rng.random() < 0.2:
+            query = query.replace("'", "\u2019")
+        log.append((kind, query))
+    return log
+
+
+def benchmark_canonical_keys(log_filename=None, n=20000):
+    '''Replays a query log against the caches' keys and compares the
+    hit rate of raw keys with canonical keys. Every query that finds
+    its key already cached is a hit; a miss is an API call
+
+    Parameters
+    ----------
+    log_filename: string
+        a file with one search term per line, a synthetic log if None
+    n: int
+        the number of synthetic queries
+
+    Returns
+    -------
+    dict
+        the hit rate and API calls for "raw" and "canonical" keys
+    '''
+    if log_filename:
+        log = [('books', term) for term in final_project.read_terms(log_filename)]
+    else:
+        log = query_log(n)
+    canonicalize = {
+        'books': final_project.canonicalize_query,
+        'wiki': final_project.canonicalize_author,
+    }
+    results = {}
+    for name in ("raw", "canonical"):
+        seen = set()
+        hits = 0
+        for kind, query in log:
+            key = (kind, query if name == "raw" else canonicalize[kind](query))
+            if key in seen:
+                hits += 1
+            seen.add(key)
+        results[name] = {"hit_rate": hits / len(log), "api_calls": len(seen)}
+        print(f"{name:<10} hit rate {results[name]['hit_rate']:6.1%}  "
+              f"{results[name]['api_calls']} API calls")
+    return results
+
+
+def legacy_create_book_record(record_dict, search_term):
+    '''create_book_record before records became BookRecord tuples,
+    kept as the baseline for benchmark_record_parsing'''
+    keyword = search_term
+    title = record_dict['volumeInfo']['title']
+    try:
+        subtitle = record_dict['volumeInfo']['subtitle']
+    except:
+        subtitle = "No subtitle"
+    try:
+        author = record_dict['volumeInfo']['authors'][0]
+    except:
+        author = "No author"
+    try:
+        publishedDate = record_dict['volumeInfo']['publishedDate']
+    except:
+        publishedDate = "NA"
+    try:
+        category = record_dict['volumeInfo']['categories'][0]
+    except:
+        category = "No category"
+    try:
+        price = record_dict['saleInfo']['listPrice']['amount']
+    except:
+        price = "NA"
+    try:
+        averageRating = record_dict['volumeInfo']['averageRating']
+    except:
+        averageRating = 0
+    try:
+        ratingCount = record_dict['volumeInfo']['ratingsCount']
+    except:
+        ratingCount = 0
+    try:
+        volumeId = record_dict['id']
+    except:
+        volumeId = f"{title}|{publishedDate}"
+    return [title, subtitle, author, publishedDate, category, price,
+            averageRating, ratingCount, keyword, volumeId]
+
+
+def synthetic_volume(rng, i):
+    '''Builds a Google Books result in which, like in real responses,
+    many of the optional fields are missing'''
+    info = {"title": f"Book {i}"}
+    if rng.random() < 0.4:
+        info["subtitle"] = "A Novel"
+    if rng.random() < 0.9:
+        info["authors"] = [f"Author {i % 500}"]
+    if rng.random() < 0.95:
+        info["publishedDate"] = str(1900 + i % 120)
+    if rng.random() < 0.6:
+        info["categories"] = ["Fiction"]
+    if rng.random() < 0.3:
+        info["averageRating"] = 4.0
+        info["ratingsCount"] = i % 1000
+    volume = {"id": f"vol{i}", "volumeInfo": info, "saleInfo": {}}
+    if rng.random() < 0.2:
+        volume["saleInfo"]["listPrice"] = {"amount": 9.99}
+    return volume
+
+
+def book_corpus(n):
+    '''Returns the items of the local Google Books cache if there is
+    one, otherwise n synthetic results'''
+    store_filename = os.path.splitext(final_project.CACHE_BOOK_FILENAME)[0] + ".sqlite"
+    corpus = []
+    if os.path.exists(store_filename):
+        store = final_project.SqliteCacheStore(store_filename)
+        for search_term, book_result in store.iter_items():
+            corpus.extend((item, search_term) for item in book_result.get('items', []))
+        store.close()
+    if not corpus:
+        rng = random.Random(507)
+        corpus = [(synthetic_volume(rng, i), "benchmark") for i in range(n)]
+    return corpus
+
+
+def benchmark_record_parsing(n=200000):
+    '''Compares create_book_record with the try/except implementation it
+    replaced on a corpus of Google Books results
+
+    Parameters
+    ----------
+    n: int
+        the number of synthetic results if there is no local cache
+
+    Returns
+    -------
+    dict
+        records per second for the "legacy" and "current" parsers
+    '''
+    corpus = book_corpus(int(n))
+    results = {}
+    for name, parse in (("legacy", legacy_create_book_record),
+                        ("current", final_project.create_book_record)):
+        start = time.perf_counter()
+        for item, search_term in corpus:
+            parse(item, search_term)
+        seconds = time.perf_counter() - start
+        results[name] = {"records_per_second": len(corpus) / seconds}
+        print(f"{name:<8} {results[name]['records_per_second']:12,.0f} records/s "
+              f"({len(corpus)} records)")
+    return results
+
+
+def rating_columns(n, seed=507):
+    '''Builds n books' ratings the way Google Books reports them:
+    half-star averages, long-tailed rating counts and a third of the
+    books unrated'''
+    rng = random.Random(seed)
+    nan = float('nan')
+    average_rating = []
+    rating_count = []
+    for i in range(n):
+        if rng.random() < 0.3:
+            average_rating.append(nan)
+            rating_count.append(nan)
+        else:
+            average_rating.append(rng.randrange(2, 11) / 2)
+            rating_count.append(float(int(rng.paretovariate(1.2))))
+    title = [f"{rng.choice(SEARCH_TERMS)}: Volume {i} of the Collected Edition"
+             for i in range(n)]
+    return {"average_rating": average_rating, "rating_count": rating_count,
+            "title": title}
+
+
+def benchmark_rating_scatter(sizes="1000,10000,100000"):
+    '''Compares the plain Scatter figure with build_rating_scatter on
+    growing numbers of books: time to build the figure and size of its
+    HTML without plotly.js
+
+    Parameters
+    ----------
+    sizes: string
+        comma-separated numbers of books
+
+    Returns
+    -------
+    dict
+        build seconds and HTML bytes per variant and number of books
+    '''
+    import plotly.graph_objs as go
+    results = {}
+    for n in [int(size) for size in sizes.split(",")]:
+        columns = rating_columns(n)
+        for name in ("scatter", "current"):
+            start = time.perf_counter()
+            if name == "scatter":
+                fig = go.Figure(data=go.Scatter(
+                    x=columns["average_rating"], y=columns["rating_count"],
+                    hovertext=columns["title"], mode='markers'))
+            else:
+                fig = final_project.build_rating_scatter(columns)
+            html = fig.to_html(include_plotlyjs=False)
+            seconds = time.perf_counter() - start
+            results[(name, n)] = {"seconds": seconds, "html_bytes": len(html)}
+            print(f"{name:<8} {n:>8} books  {seconds:7.3f} s  "
+                  f"{len(html) / 1024:10,.0f} KiB")
+    return results
+
+
+LAZY_MODULES = ("plotly", "bs4", "requests", "numpy")
+
+
+def import_times(module):
+    '''Imports module in a fresh interpreter with -X importtime
+
+    Parameters
+    ----------
+    module: string
+        the module to import
+
+    Returns
+    -------
+    dict
+        the cumulative import time in microseconds of every module
+        imported, by name
+    '''
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True, check=True)
+    times = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line.split("|")
+        if name.strip() == "site":
+            # what the interpreter imports before running -c
+            times = {}
+            continue
+        times[name.strip()] = int(cumulative_us)
+    return times
+
+
+def benchmark_startup(runs=5):
+    '''Measures how long importing final_project takes with
+    python -X importtime, and checks that the heavy dependencies in
+    LAZY_MODULES are not imported at startup
+
+    Parameters
+    ----------
+    runs: int
+        the number of fresh interpreters, the fastest one is reported
+
+    Returns
+    -------
+    dict
+        the import time in milliseconds, the slowest imported modules
+        and the lazy modules imported at startup, which should be none
+    '''
+    fastest = None
+    for _ in range(int(runs)):
+        times = import_times("final_project")
+        if fastest is None or times["final_project"] < fastest["final_project"]:
+            fastest = times
+    eager = sorted(name for name in fastest
+                   if name.split(".")[0] in LAZY_MODULES and "." not in name)
+    slowest = sorted(fastest.items(), key=lambda item: item[1], reverse=True)[1:6]
+    print(f"import final_project {fastest['final_project'] / 1000:7.1f} ms")
+    for name, microseconds in slowest:
+        print(f"  {name:<30} {microseconds / 1000:7.1f} ms")
+    if eager:
+        print(f"REGRESSION: imported at startup: {', '.join(eager)}")
+    return {"import_ms": fastest["final_project"] / 1000,
+            "slowest": slowest, "eager": eager}
+
+
+FIXTURES_DIR = "benchmark_fixtures"
+RESULTS_FILENAME = "benchmark_results.jsonl"
+REGRESSION_THRESHOLD = 1.2
+ELLE_TITLES = 27
+
+
+class Fixtures:
+    '''API responses for the stub server: the ones recorded in dirname,
+    and deterministic synthetic ones for everything else
+
+    Parameters
+    ----------
+    dirname: string
+        the directory written by record_fixtures
+    '''
+    def __init__(self, dirname=FIXTURES_DIR):
+        self.dirname = dirname
+        self.google_books_pages = self.load("google_books.json", {})
+        self.wikipedia_pages = self.load("wikipedia.json", {})
+        self.elle_html = self.load("elle.html", None)
+
+    def load(self, filename, default):
+        path = os.path.join(self.dirname, filename)
+        if not os.path.exists(path):
+            return default
+        with open(path, encoding="utf-8") as fixture_file:
+            if filename.endswith(".json"):
+                return json.load(fixture_file)
+            return fixture_file.read()
+
+    def google_books(self, search_term, start_index):
+        '''Returns the Google Books response for a page of a search'''
+        key = f"{search_term}|{start_index}"
+        if key in self.google_books_pages:
+            return self.google_books_pages[key]
+        rng = random.Random(search_term)
+        total = 100
+        items = []
+        for i in range(start_index, min(start_index + final_project.GOOGLE_BOOKS_PAGE_SIZE, total)):
+            volume = synthetic_volume(rng, i)
+            volume["id"] = f"{search_term}-{i}"
+            volume["volumeInfo"]["title"] = f"{search_term.title()} {i}"
+            items.append(volume)
+        return {"kind": "books#volumes", "totalItems": total, "items": items}
+
+    def wikipedia(self, author):
+        '''Returns the "query" part of the Wikipedia response for an
+        author'''
+        if author in self.wikipedia_pages:
+            return self.wikipedia_pages[author]
+        pages = {}
+        for i in range(10):
+            title = f"{author.title()} ({i})" if i else author.title()
+            pages[str(1000 + i)] = {
+                "pageid": 1000 + i, "title": title,
+                "fullurl": "https://en.wikipedia.org/wiki/" + title.replace(" ", "_")}
+        return {"pages": pages}
+
+    def elle(self):
+        '''Returns the Elle page'''
+        if self.elle_html is not None:
+            return self.elle_html
+        slides = "".join(
+            f'<div class="listicle-slide-hed-text"><i>{SEARCH_TERMS[i % len(SEARCH_TERMS)]} {i}</i></div>'
+            for i in range(ELLE_TITLES))
+        return f"<html><body>{slides}</body></html>"
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    '''Answers the requests of final_project.py from the server's
+    fixtures, over keep-alive connections like the real APIs'''
+    protocol_version = "HTTP/1.1"
+    # one write per response, so delayed ACKs do not stall keep-alive
+    wbufsize = -1
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {name: values[0] for name, values in parse_qs(url.query).items()}
+        fixtures = self.server.fixtures
+        if url.path == "/books/v1/volumes":
+            body = json.dumps(fixtures.google_books(
+                params.get("q", ""), int(params.get("startIndex", 0))))
+            content_type = "application/json"
+        elif url.path == "/w/api.php":
+            body = json.dumps({"query": fixtures.wikipedia(params.get("gsrsearch", ""))})
+            content_type = "application/json"
+        elif url.path == "/elle":
+            body = fixtures.elle()
+            content_type = "text/html; charset=utf-8"
+        else:
+            self.send_error(404)
+            return
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@contextlib.contextmanager
+def stub_server(fixtures=None):
+    '''Serves the fixtures on a local port and points final_project's
+    API URLs at it for the duration of the block
+
+    Parameters
+    ----------
+    fixtures: Fixtures
+        the responses served, the recorded ones if None
+
+    Returns
+    -------
+    generator
+        yields the server
+    '''
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    server.fixtures = fixtures or Fixtures()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    urls = (final_project.GOOGLE_BOOKS_URL, final_project.WIKIPEDIA_URL,
+            final_project.INSPIRED_URL)
+    final_project.GOOGLE_BOOKS_URL = base + "/books/v1/volumes"
+    final_project.WIKIPEDIA_URL = base + "/w/api.php"
+    final_project.INSPIRED_URL = base + "/elle"
+    try:
+        yield server
+    finally:
+        (final_project.GOOGLE_BOOKS_URL, final_project.WIKIPEDIA_URL,
+         final_project.INSPIRED_URL) = urls
+        server.shutdown()
+        server.server_close()
+
+
+ISOLATED_GLOBALS = (
+    "DB_SESSION", "CACHE_BOOK_FILENAME", "CACHE_BOOK_DICT",
+    "CACHE_WIKI_FILENAME", "CACHE_WIKI_DICT", "CACHE_STORES",
+    "QUOTA_FILENAME", "GOOGLE_BOOKS_QUOTA", "GOOGLE_BOOKS_PER_SECOND",
+    "GOOGLE_BOOKS_BURST", "GOOGLE_BOOKS_PER_DAY", "INSPIRED_FILENAME",
+    "INSPIRED_TITLE_LIST", "INSPIRED_LOADER",
+)
+
+
+@contextlib.contextmanager
+def isolated_project():
+    '''Points final_project's database, caches, quota state and
+    inspired list at a temporary directory, and lifts the API pacing,
+    for the duration of the block
+
+    Parameters
+    ----------
+    none
+
+    Returns
+    -------
+    generator
+        yields the temporary directory
+    '''
+    saved = {name: getattr(final_project, name) for name in ISOLATED_GLOBALS}
+    had_key = hasattr(final_project.secrets, "GOOGLE_API_KEY")
+    with tempfile.TemporaryDirectory() as tmp:
+        final_project.DB_SESSION = final_project.DatabaseSession(
+            os.path.join(tmp, "bench.sqlite"))
+        final_project.CACHE_BOOK_FILENAME = os.path.join(tmp, "google_books_cache.json")
+        final_project.CACHE_BOOK_DICT = {}
+        final_project.CACHE_WIKI_FILENAME = os.path.join(tmp, "wiki_cache.json")
+        final_project.CACHE_WIKI_DICT = {}
+        final_project.CACHE_STORES = {}
+        final_project.QUOTA_FILENAME = os.path.join(tmp, "quota.json")
+        final_project.GOOGLE_BOOKS_QUOTA = None
+        final_project.GOOGLE_BOOKS_PER_SECOND = 1e9
+        final_project.GOOGLE_BOOKS_BURST = 1e9
+        final_project.GOOGLE_BOOKS_PER_DAY = None
+        final_project.INSPIRED_FILENAME = os.path.join(tmp, "inspired_titles.json")
+        final_project.INSPIRED_TITLE_LIST = []
+        final_project.INSPIRED_LOADER = None
+        if not had_key:
+            final_project.secrets.GOOGLE_API_KEY = "benchmark"
+        final_project.create_database()
+        try:
+            yield tmp
+        finally:
+            executor = final_project.WIKI_EXECUTOR
+            final_project.shutdown_wiki_prefetch()
+            if executor is not None:
+                executor.shutdown(wait=True)
+            for store in final_project.CACHE_STORES.values():
+                store.close()
+            final_project.DB_SESSION.close()
+            for name, value in saved.items():
+                setattr(final_project, name, value)
+            if not had_key:
+                del final_project.secrets.GOOGLE_API_KEY
+
+
+def latency_summary(samples):
+    '''Summarizes durations in seconds as mean, p50, p95 and max in
+    milliseconds'''
+    samples = sorted(samples)
+    return {
+        "mean_ms": sum(samples) / len(samples) * 1000,
+        "p50_ms": samples[len(samples) // 2] * 1000,
+        "p95_ms": samples[min(int(len(samples) * 0.95), len(samples) - 1)] * 1000,
+        "max_ms": samples[-1] * 1000,
+    }
+
+
+def timed(function, *args, **kwargs):
+    '''Calls function with its output hidden, returning the seconds it
+    took and its result'''
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        return time.perf_counter() - start, result
+
+
+def benchmark_end_to_end(n=20, max_results=50):
+    '''Runs searches through the whole program against the stub
+    server: first from the API, then again from the database, the
+    author lookups of each search, and loading the inspired list
+
+    Parameters
+    ----------
+    n: int
+        the number of search terms
+    max_results: int
+        the most results per search
+
+    Returns
+    -------
+    dict
+        latency summaries of the "cold_search", "warm_search",
+        "author_lookup" and "inspired_list" stages
+    '''
+    terms = [f"{SEARCH_TERMS[i % len(SEARCH_TERMS)]} {i}" for i in range(int(n))]
+    samples = {"cold_search": [], "warm_search": [], "author_lookup": [],
+               "inspired_list": []}
+    with isolated_project(), stub_server():
+        for term in terms:
+            seconds, book_results = timed(
+                final_project.search_for_books, term, int(max_results))
+            samples["cold_search"].append(seconds)
+            final_project.cancel_wiki_prefetch()
+            for i, book in enumerate(book_results[:3]):
+                if book[2] is not None:
+                    seconds, _ = timed(final_project.search_on_wiki, book_results, i + 1)
+                    samples["author_lookup"].append(seconds)
+        for term in terms:
+            seconds, _ = timed(final_project.search_for_books, term, int(max_results))
+            samples["warm_search"].append(seconds)
+        for _ in range(5):
+            seconds, _ = timed(final_project.build_inspired_titles_list)
+            samples["inspired_list"].append(seconds)
+    results = {stage: latency_summary(stage_samples)
+               for stage, stage_samples in samples.items() if stage_samples}
+    for stage, summary in results.items():
+        print(f"{stage:<14} p50 {summary['p50_ms']:8.2f} ms  "
+              f"p95 {summary['p95_ms']:8.2f} ms")
+    return results
+
+
+def benchmark_ingest(n=50000):
+    '''Measures how fast parsed records are written to the database,
+    one API page at a time and in large batches
+
+    Parameters
+    ----------
+    n: int
+        the number of records written per batch size
+
+    Returns
+    -------
+    dict
+        rows per second by batch size
+    '''
+    rng = random.Random(507)
+    n = int(n)
+    results = {}
+    for batch_size in (final_project.GOOGLE_BOOKS_PAGE_SIZE, 1000):
+        records = [final_project.create_book_record(
+                       synthetic_volume(rng, i), f"term {i // 25}")
+                   for i in range(n)]
+        with isolated_project():
+            start = time.perf_counter()
+            for i in range(0, n, batch_size):
+                final_project.insert_records_to_books(records[i:i + batch_size])
+            seconds = time.perf_counter() - start
+        results[f"batch_{batch_size}"] = {"rows_per_second": n / seconds}
+        print(f"batch {batch_size:>5}  {n / seconds:12,.0f} rows/s")
+    return results
+
+
+def benchmark_cache_lookup(sizes="1000,10000,100000", lookups=20000):
+    '''Measures the cost of a cache lookup as the cache grows: hits in
+    the in-memory tier, hits that go to the SQLite store, and misses
+
+    Parameters
+    ----------
+    sizes: string
+        comma-separated numbers of cached responses
+    lookups: int
+        the number of lookups of each kind
+
+    Returns
+    -------
+    dict
+        microseconds per lookup by cache size and kind
+    '''
+    rng = random.Random(507)
+    response = Fixtures().google_books("benchmark", 0)
+    lookups = int(lookups)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in [int(size) for size in sizes.split(",")]:
+            store = final_project.SqliteCacheStore(os.path.join(tmp, f"cache{size}.sqlite"))
+            for start in range(0, size, 1000):
+                store.put_many((f"key {i}", response)
+                               for i in range(start, min(start + 1000, size)))
+            cache = final_project.TieredCache(store)
+            hot = [f"key {i}" for i in range(min(size, 64))]
+            kinds = {
+                "memory_hit": [rng.choice(hot) for _ in range(lookups)],
+                "store_hit": [f"key {rng.randrange(size)}" for _ in range(lookups)],
+                "miss": [f"missing {i}" for i in range(lookups)],
+            }
+            for key in hot:
+                cache.get(key)
+            results[str(size)] = {}
+            for kind, keys in kinds.items():
+                start = time.perf_counter()
+                for key in keys:
+                    cache.get(key)
+                microseconds = (time.perf_counter() - start) / lookups * 1e6
+                results[str(size)][f"{kind}_us"] = microseconds
+                print(f"{size:>8} entries  {kind:<10} {microseconds:8.2f} us/lookup")
+            store.close()
+    return results
+
+
+def benchmark_query_latency(sizes="1000,10000,100000", repeats=200):
+    '''Measures the database queries and figure building as the
+    database grows: the per-search queries for a random search term,
+    the full-text search, the corpus report and the charts of the whole
+    corpus
+
+    Parameters
+    ----------
+    sizes: string
+        comma-separated numbers of books
+    repeats: int
+        the number of per-search queries of each kind
+
+    Returns
+    -------
+    dict
+        milliseconds per call by database size and query
+    '''
+    rng = random.Random(507)
+    repeats = int(repeats)
+    results = {}
+    for size in [int(size) for size in sizes.split(",")]:
+        keywords = [f"term {i}" for i in range(max(size // 25, 1))]
+        records = [final_project.create_book_record(
+                       synthetic_volume(rng, i), keywords[i % len(keywords)])
+                   for i in range(size)]
+        with isolated_project():
+            for i in range(0, size, 1000):
+                final_project.insert_records_to_books(records[i:i + 1000])
+            per_search = {
+                "extract_books": final_project.extract_book_from_database,
+                "count_category": final_project.count_books_category,
+                "ratings_info": final_project.get_ratings_info,
+                "local_search": final_project.search_local_books,
+            }
+            timings = {}
+            for name, query in per_search.items():
+                start = time.perf_counter()
+                for _ in range(repeats):
+                    query(rng.choice(keywords))
+                timings[f"{name}_ms"] = (time.perf_counter() - start) / repeats * 1000
+            corpus = {
+                "corpus_report": final_project.corpus_report,
+                "category_barchart": lambda: final_project.build_category_barchart(
+                    final_project.count_books_category(None, columnar=True)),
+                "rating_scatter": lambda: final_project.build_rating_scatter(
+                    final_project.get_ratings_info(None, columnar=True)),
+            }
+            for name, query in corpus.items():
+                timed(query) # warm up, plotly is imported on first use
+                seconds, _ = timed(query)
+                timings[f"{name}_ms"] = seconds * 1000
+        results[str(size)] = timings
+        for name, milliseconds in timings.items():
+            print(f"{size:>8} books  {name:<22} {milliseconds:9.3f} ms")
+    return results
+
+
+def record_fixtures(dirname=FIXTURES_DIR, max_results=50):
+    '''Records live responses for the stub server: the Google Books
+    pages of SEARCH_TERMS, the Wikipedia results of their first authors
+    and the Elle page. Needs the API key and the network
+
+    Parameters
+    ----------
+    dirname: string
+        the directory the fixtures are written to
+    max_results: int
+        the most Google Books results recorded per term
+
+    Returns
+    -------
+    dict
+        the number of recorded responses per source
+    '''
+    os.makedirs(dirname, exist_ok=True)
+    google_books = {}
+    wikipedia = {}
+    for term in map(final_project.canonicalize_query, SEARCH_TERMS):
+        for start in range(0, int(max_results), final_project.GOOGLE_BOOKS_PAGE_SIZE):
+            page = final_project.fetch_google_books(term, start, final_project.quota.BATCH)
+            google_books[f"{term}|{start}"] = page
+            for item in page.get('items', [])[:3]:
+                authors = item['volumeInfo'].get('authors')
+                if authors:
+                    author = final_project.canonicalize_author(authors[0])
+                    if author not in wikipedia:
+                        wikipedia[author] = final_project.fetch_wiki_results(author)
+            if len(page.get('items', [])) < final_project.GOOGLE_BOOKS_PAGE_SIZE:
+                break
+    elle = final_project.http_client.get_client().get(final_project.INSPIRED_URL).text
+    for filename, content in (("google_books.json", json.dumps(google_books)),
+                              ("wikipedia.json", json.dumps(wikipedia)),
+                              ("elle.html", elle)):
+        with open(os.path.join(dirname, filename), "w", encoding="utf-8") as fixture_file:
+            fixture_file.write(content)
+    counts = {"google_books": len(google_books), "wikipedia": len(wikipedia)}
+    print(f"Recorded {counts['google_books']} Google Books pages and "
+          f"{counts['wikipedia']} Wikipedia searches to {dirname}")
+    return counts
+
+
+def flatten(results, prefix=""):
+    '''Flattens nested benchmark results into {"a.b.c": number}'''
+    flat = {}
+    for key, value in results.items():
+        if isinstance(key, tuple):
+            key = "-".join(map(str, key))
+        name = f"{prefix}.{key}" if prefix else str(key)
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def lower_is_better(metric):
+    '''Returns True for durations and sizes, False for rates, and None
+    for metrics that are not compared'''
+    if metric.endswith(("per_second", "hit_rate")):
+        return False
+    if metric.endswith(("_ms", "_us", "seconds", "bytes")):
+        return True
+    return None
+
+
+def current_commit():
+    '''Returns the checked out git commit, or None outside a repo'''
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(*names, results_filename=RESULTS_FILENAME):
+    '''Runs the suite, appends the results to results_filename and
+    compares them with the previous run in that file, flagging every
+    metric more than REGRESSION_THRESHOLD times worse
+
+    Parameters
+    ----------
+    names: strings
+        the benchmarks to run, all of SUITE if none
+    results_filename: string
+        the JSON lines file of earlier runs
+
+    Returns
+    -------
+    dict
+        the run, with its flattened results
+    '''
+    results = {}
+    for name in names or SUITE:
+        print(f"== {name}")
+        results.update(flatten(BENCHMARKS[name](), name))
+    run = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": current_commit(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "results": results,
+    }
+
+    previous = None
+    if os.path.exists(results_filename):
+        with open(results_filename, encoding="utf-8") as results_file:
+            lines = [line for line in results_file if line.strip()]
+        if lines:
+            previous = json.loads(lines[-1])
+    with open(results_filename, "a", encoding="utf-8") as results_file:
+        results_file.write(json.dumps(run) + "\n")
+
+    if previous is None:
+        print(f"Saved the first run to {results_filename}")
+        return run
+    print(f"== compared with {previous['timestamp']} ({previous.get('commit')})")
+    regressions = 0
+    for metric, value in results.items():
+        direction = lower_is_better(metric)
+        before = previous["results"].get(metric)
+        if direction is None or not before or not value:
+            continue
+        worse = value / before if direction else before / value
+        flag = ""
+        if worse > REGRESSION_THRESHOLD:
+            flag = "  REGRESSION"
+            regressions += 1
+        print(f"{metric:<52} {before:12.3f} -> {value:12.3f}  {worse:5.2f}x{flag}")
+    print(f"{regressions} regressions")
+    return run
+
+
+SUITE = ("end_to_end", "ingest", "cache_lookup", "query_latency")
+
+def suite_command(*args):
+    '''Runs run_suite with the command line arguments: the benchmarks
+    to run, and --results FILE to use another results file'''
+    parser = argparse.ArgumentParser(prog="benchmarks.py suite")
+    parser.add_argument("names", nargs="*", metavar="benchmark",
+                        help="the benchmarks to run, all of the suite if none")
+    parser.add_argument("--results", default=RESULTS_FILENAME, metavar="FILE",
+                        help=f"the results file, {RESULTS_FILENAME} by default")
+    options = parser.parse_args(args)
+    for name in options.names:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark {name!r}")
+    return run_suite(*options.names, results_filename=options.results)
+
+
+COMMANDS = {
+    "suite": suite_command,
+    "record": record_fixtures,
+}
+
+
+BENCHMARKS = {
+    "statement_cache": benchmark_statement_cache,
+    "canonical_keys": benchmark_canonical_keys,
+    "record_parsing": benchmark_record_parsing,
+    "rating_scatter": benchmark_rating_scatter,
+    "startup": benchmark_startup,
+    "end_to_end": benchmark_end_to_end,
+    "ingest": benchmark_ingest,
+    "cache_lookup": benchmark_cache_lookup,
+    "query_latency": benchmark_query_latency,
+}
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] and sys.argv[1] in COMMANDS:
+        COMMANDS[sys.argv[1]](*sys.argv[2:])
+    elif sys.argv[1:]:
+        print(f"== {sys.argv[1]}")
+        BENCHMARKS[sys.argv[1]](*sys.argv[2:])
+    else:
+        for name, benchmark in BENCHMARKS.items():
+            print(f"== {name}")
+            benchmark()
@@ -1,50 +1,340 @@
-from bs4 import BeautifulSoup
-import requests
 import json
+import os
 import secrets # file that contains API key
+import argparse
+import atexit
+import hashlib
+import itertools
+import re
 import sqlite3
 import sys
-import plotly.graph_objs as go
+import queue
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+from typing import NamedTuple, Optional
+import http_client
+import metrics
+import queries
+import quota
+# plotly, bs4 and multiprocessing are imported by the functions that
+# use them, since most runs never need them and they slow startup
 
 CACHE_BOOK_FILENAME = "google_books_cache.json"
 CACHE_BOOK_DICT = {}
 CACHE_WIKI_FILENAME = "wiki_cache.json"
 CACHE_WIKI_DICT = {}
+CACHE_BACKEND = "sqlite"
+CACHE_STORES = {}
+CACHE_MEMORY_ENTRIES = 256
+CACHE_BOOK_TTL = 7 * 24 * 60 * 60 # ratings change, refresh weekly
+CACHE_WIKI_TTL = 30 * 24 * 60 * 60
+CACHE_STALE_WHILE_REVALIDATE = True
+CACHE_KEY_VERSION = 1 # keys are canonical search terms and author's names
+ALIASES_FILENAME = "query_aliases.json"
+QUERY_ALIASES = None
+QUOTE_TRANSLATION = str.maketrans("‘’‚‛“”„‟", "''''\"\"\"\"")
+NAME_SUFFIXES = {"jr", "jnr", "sr", "snr", "ii", "iii", "iv", "v",
+                 "phd", "md", "dds", "esq", "obe", "mbe", "cbe", "kbe"}
 INSPIRED_TITLE_LIST = []
+INSPIRED_FILENAME = "inspired_titles.json"
+INSPIRED_LOADER = None
+DB_FILENAME = "finalproject.sqlite"
+DB_SESSION = None
+DB_POOL_SIZE = 4
+DB_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -16000, # 16 MB page cache per connection
+}
+BATCH_CONCURRENCY = 8
+LOCAL_FIRST = False
+LOCAL_MIN_RESULTS = 10
+LOCAL_MAX_SCORE = -1.0 # bm25 score a local match must reach, lower is better
+LOCAL_PREFIX_MIN_LENGTH = 3
+LOCAL_IGNORED_CHARACTERS = re.compile(r"[\w\s'\".,:;!?()-]")
+PRICE_BUCKET = 5
+SCATTER_WEBGL_THRESHOLD = 5000
+SCATTER_MAX_POINTS = 20000
+HOVER_TITLE_LENGTH = 40
+REPORT_TOP = 10
+GOOGLE_BOOKS_PAGE_SIZE = 25
+GOOGLE_BOOKS_MAX_RESULTS = 25
+GOOGLE_BOOKS_PREFETCH = 2
+GOOGLE_BOOKS_PER_SECOND = 2
+GOOGLE_BOOKS_BURST = 5
+GOOGLE_BOOKS_PER_DAY = 1000 # the API key's default daily quota
+GOOGLE_BOOKS_QUOTA = None
+GOOGLE_BOOKS_CLIENT = None
+GOOGLE_BOOKS_ATTEMPTS = 4 # requests per page, counting retries after a 429 or 5xx
+QUOTA_FILENAME = "google_books_quota.json"
+QUOTA_LOCK = threading.Lock()
+PAGE_EXECUTOR = None
+PAGE_EXECUTOR_LOCK = threading.Lock()
+WIKI_PREFETCH_LIMIT = 5
+WIKI_PREFETCH_CONCURRENCY = 3
+WIKI_EXECUTOR = None
+WIKI_PREFETCH = None
+GOOGLE_BOOKS_URL = 'https://www.googleapis.com/books/v1/volumes'
+WIKIPEDIA_URL = 'https://en.wikipedia.org/w/api.php'
+INSPIRED_URL = 'https://www.elle.com/culture/books/g29954140/best-books-2020/'
 
 # FUNCTIONS
-def get_google_books(search_term):
-    '''Obtain API data from Google Books API with use of cache
+def get_google_books(search_term, start_index=0, priority=quota.INTERACTIVE,
+                     allow_stale=True):
+    '''Obtain API data from Google Books API with use of cache.
+    The search term is canonicalized first, and every page of
+    results is cached on its own
     
     Parameters
     ----------
     search_term: string
         the search term inputted
+    start_index: int
+        the position of the first result of the page
+    priority: int
+        quota.INTERACTIVE or quota.BATCH, if the API is requested
+    allow_stale: bool
+        whether an expired page may be served while it is refreshed;
+        False when the page is saved to the database as fresh
 
     Returns
     -------
     dict
         results returned by API
     '''
-    if search_term in CACHE_BOOK_DICT.keys():
-        return CACHE_BOOK_DICT[search_term]
-    else:
-        base_url = 'https://www.googleapis.com/books/v1/volumes?'
-        params = {
-            "key": secrets.GOOGLE_API_KEY,
-            "q": search_term,
-            "printType": "books",
-            "maxResults": 25
-        }
-        response = requests.get(base_url, params)
-        CACHE_BOOK_DICT[search_term] = response.json()
-        save_cache(CACHE_BOOK_DICT, CACHE_BOOK_FILENAME)
-        return CACHE_BOOK_DICT[search_term]
+    open_caches()
+    search_term = canonicalize_query(search_term)
+    key = search_term if start_index == 0 else f"{search_term}|start={start_index}"
+    return CACHE_BOOK_DICT.get_or_fetch(
+        key, lambda: fetch_google_books(search_term, start_index, priority),
+        allow_stale)
+
+
+def fetch_google_books(search_term, start_index=0, priority=quota.INTERACTIVE):
+    '''Request the Google Books API, bypassing the cache. The request
+    waits its turn in the API key's quota; a 429 pauses every request
+    for its Retry-After, a 5xx for its Retry-After or a backoff, and
+    both are retried, up to GOOGLE_BOOKS_ATTEMPTS requests, and a spent
+    daily quota stops them all
+
+    Parameters
+    ----------
+    search_term: string
+        the search term inputted
+    start_index: int
+        the position of the first result of the page
+    priority: int
+        quota.INTERACTIVE or quota.BATCH, interactive requests go first
+
+    Returns
+    -------
+    dict
+        results returned by API
+    '''
+    params = {
+        "key": secrets.GOOGLE_API_KEY,
+        "q": search_term,
+        "printType": "books",
+        "maxResults": GOOGLE_BOOKS_PAGE_SIZE,
+        "startIndex": start_index
+    }
+    scheduler = get_quota_scheduler()
+    client = get_google_books_client()
+    for attempt in range(GOOGLE_BOOKS_ATTEMPTS):
+        with metrics.span("google_books.quota_wait"):
+            scheduler.acquire(priority)
+        with metrics.span("google_books.request"):
+            response = client.get(GOOGLE_BOOKS_URL, params)
+        metrics.count("google_books.api_calls")
+        metrics.count("google_books.bytes_received", len(response.content))
+        if response.status_code not in http_client.RETRY_STATUSES:
+            break
+        #wait out the pause in acquire, so every retry takes a token
+        retry_after = response.headers.get("Retry-After")
+        if response.status_code == 429 or retry_after:
+            scheduler.retry_after(quota.parse_retry_after(retry_after))
+        elif attempt + 1 < GOOGLE_BOOKS_ATTEMPTS:
+            scheduler.retry_after(http_client.BACKOFF_FACTOR * 2 ** attempt)
+    if response.status_code == 403 and "dailyLimitExceeded" in response.text:
+        scheduler.exhaust()
+    response.raise_for_status()
+    return response.json()
+
+
+def get_quota_scheduler():
+    '''Returns the scheduler pacing requests with the Google Books API
+    key, creating it on first use with the state saved in
+    QUOTA_FILENAME
+
+    Parameters
+    ----------
+    none
+
+    Returns
+    -------
+    quota.QuotaScheduler
+        the shared scheduler
+    '''
+    global GOOGLE_BOOKS_QUOTA
+    with QUOTA_LOCK:
+        if GOOGLE_BOOKS_QUOTA is None:
+            GOOGLE_BOOKS_QUOTA = quota.QuotaScheduler(
+                GOOGLE_BOOKS_PER_SECOND, GOOGLE_BOOKS_BURST,
+                GOOGLE_BOOKS_PER_DAY, QUOTA_FILENAME)
+    return GOOGLE_BOOKS_QUOTA
+
+
+def get_google_books_client():
+    '''Returns the HttpClient for the Google Books API, creating it on
+    first use. It never retries a request itself: fetch_google_books
+    does, through the scheduler, so that every request sent is counted
+
+    Parameters
+    ----------
+    none
+
+    Returns
+    -------
+    http_client.HttpClient
+        the client
+    '''
+    global GOOGLE_BOOKS_CLIENT
+    with QUOTA_LOCK:
+        if GOOGLE_BOOKS_CLIENT is None:
+            GOOGLE_BOOKS_CLIENT = http_client.HttpClient(retries=0, retry_statuses=())
+    return GOOGLE_BOOKS_CLIENT
+
+
+def iter_book_pages(search_term, max_results=GOOGLE_BOOKS_MAX_RESULTS,
+                    prefetch=GOOGLE_BOOKS_PREFETCH, priority=quota.INTERACTIVE):
+    '''Pages lazily through the Google Books results for a search term,
+    yielding the extracted records of each page as it arrives. Up to
+    prefetch pages after the current one are requested concurrently
+
+    Parameters
+    ----------
+    search_term: string
+        the search term inputted
+    max_results: int
+        the most results to page through
+    prefetch: int
+        the number of pages requested ahead of the consumer, at least one
+    priority: int
+        quota.INTERACTIVE or quota.BATCH
+
+    Returns
+    -------
+    generator
+        a list of extracted records per page
+    '''
+    executor = get_page_executor()
+    open_caches()
+
+    #the first page tells how many results there are
+    #the pages are saved to the database as fresh, so never serve stale ones
+    first_page = get_google_books(search_term, 0, priority, False)
+    items = first_page.get('items', [])[:max_results]
+    total = min(first_page.get('totalItems', 0), max_results)
+    if len(items) < GOOGLE_BOOKS_PAGE_SIZE:
+        total = 0
+    starts = iter(range(GOOGLE_BOOKS_PAGE_SIZE, total, GOOGLE_BOOKS_PAGE_SIZE))
+
+    pending = []
+    try:
+        for start in starts:
+            pending.append((start, executor.submit(
+                get_google_books, search_term, start, priority, False)))
+            if len(pending) >= max(prefetch, 1):
+                break
+        yield parse_book_page(items, search_term)
+        while pending:
+            start, future = pending.pop(0)
+            next_start = next(starts, None)
+            if next_start is not None:
+                pending.append((next_start, executor.submit(
+                    get_google_books, search_term, next_start, priority, False)))
+            items = future.result().get('items', [])[:max_results - start]
+            if items:
+                yield parse_book_page(items, search_term)
+            if len(items) < GOOGLE_BOOKS_PAGE_SIZE:
+                return
+    finally:
+        for start, future in pending:
+            future.cancel()
+
+
+def parse_book_page(items, search_term):
+    '''Extracts the records of one page of Google Books results
+
+    Parameters
+    ----------
+    items: list
+        the results of the page
+    search_term: string
+        the search term inputted
+
+    Returns
+    -------
+    list
+        a list of BookRecord
+    '''
+    with metrics.span("google_books.parse"):
+        records = [create_book_record(item, search_term) for item in items]
+    metrics.count("google_books.records_parsed", len(records))
+    return records
+
+
+def get_page_executor():
+    '''Returns the thread pool that prefetches pages of results,
+    creating it on first use. Batch workers page through searches at
+    the same time, so creation is guarded by PAGE_EXECUTOR_LOCK
+
+    Parameters
+    ----------
+    none
+
+    Returns
+    -------
+    ThreadPoolExecutor
+        the shared executor
+    '''
+    global PAGE_EXECUTOR
+    with PAGE_EXECUTOR_LOCK:
+        if PAGE_EXECUTOR is None:
+            PAGE_EXECUTOR = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY)
+    return PAGE_EXECUTOR
+
+
+class BookRecord(NamedTuple):
+    '''Information extracted from one Google Books result. Fields the
+    API did not return are None'''
+    title: str
+    subtitle: Optional[str]
+    author: Optional[str]
+    published_date: Optional[str]
+    category: Optional[str]
+    price: Optional[float]
+    average_rating: Optional[float]
+    rating_count: Optional[int]
+    keyword: str
+    volume_id: str
+
+
+class WikiRecord(NamedTuple):
+    '''Information extracted from one Wikipedia result'''
+    title: str
+    url: str
+    search_term: str
 
 
 def create_book_record(record_dict, search_term):
-    '''Extract required information from the Google Books API results,
-    save as a list
+    '''Extract required information from the Google Books API results
+    in a single pass, with None for the fields that are missing
 
     Parameters
     ----------
@@ -55,54 +345,53 @@ def create_book_record(record_dict, search_term):
 
     Returns
     -------
-    list
+    BookRecord
         extracted information
     '''
-    record = []
-    keyword = search_term
-    #get title
-    title = record_dict['volumeInfo']['title']
-    #get subtitle
-    try:
-        subtitle = record_dict['volumeInfo']['subtitle']
-    except:
-        subtitle = "No subtitle"
-    #get author (first author)
-    try:
-        author = record_dict['volumeInfo']['authors'][0]
-    except:
-        author = "No author"
-    #get publish date
-    try:
-        publishedDate = record_dict['volumeInfo']['publishedDate']
-    except:
-        publishedDate = "NA"
-    #get category
-    try:
-        category = record_dict['volumeInfo']['categories'][0]
-    except:
-        category = "No category"
-    #get price
-    try:
-        price = record_dict['saleInfo']['listPrice']['amount']
-    except:
-        price = "NA"
-    #get average rating
-    try:
-        averageRating = record_dict['volumeInfo']['averageRating']
-    except:
-        averageRating = 0
-    #get rating count
-    try:
-        ratingCount = record_dict['volumeInfo']['ratingsCount']
-    except:
-        ratingCount = 0
-    
-    return [title, subtitle, author, publishedDate, category, price, averageRating, ratingCount, keyword]
+    info = record_dict.get('volumeInfo', {})
+    authors = info.get('authors')
+    categories = info.get('categories')
+    list_price = record_dict.get('saleInfo', {}).get('listPrice')
+    title = info.get('title', '')
+    published_date = info.get('publishedDate')
+    return BookRecord(
+        title,
+        info.get('subtitle'),
+        authors[0] if authors else None,
+        published_date,
+        categories[0] if categories else None,
+        list_price.get('amount') if list_price else None,
+        info.get('averageRating'),
+        info.get('ratingsCount'),
+        search_term,
+        record_dict.get('id') or f"{title}|{published_date}")
+
+
+def get_wiki_results(author, allow_stale=True):
+    '''Obtain API data from Wikipedia API with use of cache,
+    keyed on the canonical form of the author's name
 
+    Parameters
+    ----------
+    author: string
+        author's name
+    allow_stale: bool
+        whether an expired result may be served while it is refreshed;
+        False when the result is saved to the database as fresh
+
+    Returns
+    -------
+    dict
+        results returned by API
+    '''
+    open_caches()
+    author = canonicalize_author(author)
+    return CACHE_WIKI_DICT.get_or_fetch(
+        author, lambda: fetch_wiki_results(author), allow_stale)
 
-def get_wiki_results(author):
-    '''Obtain API data from Wikipedia API with use of cache
+
+def fetch_wiki_results(author):
+    '''Request the Wikipedia API, bypassing the cache
 
     Parameters
     ----------
@@ -114,27 +403,24 @@ def get_wiki_results(author):
     dict
         results returned by API
     '''
-    if author in CACHE_WIKI_DICT.keys():
-        return CACHE_WIKI_DICT[author]
-    else:
-        base_url = 'https://en.wikipedia.org/w/api.php'
-        params = {
-                "action": "query",
-                "format": "json",
-                "generator": "search",
-                "gsrsearch": author,
-                "prop": "info",
-                "inprop": "url"
-            }
-        response = requests.Session().get(url=base_url, params=params)
-        CACHE_WIKI_DICT[author] = response.json()['query']
-        save_cache(CACHE_WIKI_DICT, CACHE_WIKI_FILENAME)
-        return CACHE_WIKI_DICT[author]
+    params = {
+            "action": "query",
+            "format": "json",
+            "generator": "search",
+            "gsrsearch": author,
+            "prop": "info",
+            "inprop": "url"
+        }
+    with metrics.span("wikipedia.request"):
+        response = http_client.get_client().get(WIKIPEDIA_URL, params)
+    metrics.count("wikipedia.api_calls")
+    metrics.count("wikipedia.bytes_received", len(response.content))
+    response.raise_for_status()
+    return response.json()['query']
 
 
 def create_wikiresult_record(record_dict, search_term):
-    '''Extract required information from the Wikipedia API results,
-    save as a list
+    '''Extract required information from the Wikipedia API results
 
     Parameters
     ----------
@@ -145,17 +431,51 @@ def create_wikiresult_record(record_dict, search_term):
 
     Returns
     -------
-    list
-        extracted information
+    WikiRecord
+        extracted information, or None if the page has no URL
     '''
-    title = record_dict['title']
-    url = record_dict['fullurl']
-    searchTerm = search_term
-    return [title, url, searchTerm]
+    url = record_dict.get('fullurl')
+    if url is None:
+        return None
+    return WikiRecord(record_dict['title'], url, search_term)
+
+
+def load_inspired_titles(filename=None):
+    '''Reads the inspired books list saved by the last scrape
+
+    Parameters
+    ----------
+    filename: string
+        the file the list is saved in, INSPIRED_FILENAME if None
+
+    Returns
+    -------
+    dict
+        "titles", and the "etag" and "last_modified" headers of the page
+        they were scraped from, empty if nothing was saved
+    '''
+    filename = filename or INSPIRED_FILENAME
+    try:
+        with open(filename, encoding="utf-8") as saved_file:
+            return json.load(saved_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_inspired_titles(saved, filename=None):
+    '''Saves the inspired books list, replacing the file atomically'''
+    filename = filename or INSPIRED_FILENAME
+    with open(filename + ".tmp", "w", encoding="utf-8") as saved_file:
+        json.dump(saved, saved_file)
+    os.replace(filename + ".tmp", filename)
 
 
 def build_inspired_titles_list():
-    '''Scrape the titles from the page
+    '''Scrape the titles from the page. The list is saved to disk and
+    the page is only downloaded and parsed again when it changed: the
+    request sends the saved ETag and Last-Modified, and a 304 answer
+    keeps the saved list. If the page cannot be reached, the saved
+    list is used
 
     Parameters
     ----------
@@ -166,22 +486,39 @@ def build_inspired_titles_list():
     list
         title of each book on the page
     '''
-    title_list = []
-    base_url = 'https://www.elle.com/culture/books/g29954140/best-books-2020/'
-
-    if not INSPIRED_TITLE_LIST:
-        response = requests.get(base_url)
+    saved = load_inspired_titles()
+    headers = {}
+    if saved.get("etag"):
+        headers["If-None-Match"] = saved["etag"]
+    if saved.get("last_modified"):
+        headers["If-Modified-Since"] = saved["last_modified"]
+    try:
+        response = http_client.get_client().get(INSPIRED_URL, headers=headers)
+    except Exception:
+        if not saved.get("titles"):
+            raise
+        response = None
+
+    if response is not None and response.status_code != 304:
+        response.raise_for_status()
+        from bs4 import BeautifulSoup
         soup = BeautifulSoup(response.text, 'html.parser')
         menu = soup.find_all(class_='listicle-slide-hed-text')
-        for book in menu:
-            INSPIRED_TITLE_LIST.append(book.find('i').text)
-        
+        saved = {
+            "titles": [book.find('i').text for book in menu],
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        save_inspired_titles(saved)
+
+    INSPIRED_TITLE_LIST[:] = saved["titles"]
     return INSPIRED_TITLE_LIST
 
 
-def create_database():
-    '''Create two tables in the database to store data
-    obtained from APIs
+def start_inspired_titles_loading():
+    '''Starts building the inspired books list on a background thread.
+    A list saved by an earlier run is available right away while the
+    page is revalidated
 
     Parameters
     ----------
@@ -189,17 +526,93 @@ def create_database():
 
     Returns
     -------
+    Future
+        resolves to the list once it is up to date
+    '''
+    global INSPIRED_LOADER
+    if INSPIRED_LOADER is None:
+        INSPIRED_TITLE_LIST[:] = load_inspired_titles().get("titles", [])
+        INSPIRED_LOADER = Future()
+
+        def load():
+            try:
+                INSPIRED_LOADER.set_result(build_inspired_titles_list())
+            except Exception as error:
+                INSPIRED_LOADER.set_exception(error)
+
+        threading.Thread(target=load, daemon=True).start()
+    return INSPIRED_LOADER
+
+
+def inspired_titles():
+    '''Returns the inspired books list, waiting for the background
+    scrape only if no list is available yet
+
+    Parameters
+    ----------
     none
+
+    Returns
+    -------
+    list
+        title of each book on the page
     '''
-    conn = sqlite3.connect("finalproject.sqlite")
-    cur = conn.cursor()
+    loader = start_inspired_titles_loading()
+    if not INSPIRED_TITLE_LIST:
+        if not loader.done():
+            print("Loading the inspired books list...")
+        loader.result()
+    return list(INSPIRED_TITLE_LIST)
+
 
-    drop_books = '''
-        DROP TABLE IF EXISTS "Books";
+def create_database():
+    '''Brings the tables in the database up to date, keeping the data
+    from earlier runs. The database's user_version records how many
+    of SCHEMA_MIGRATIONS have been applied; the newer ones run in
+    order, each in its own transaction
+
+    Parameters
+    ----------
+    none
+
+    Returns
+    -------
+    none
     '''
+    with get_db_session().connection() as conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for new_version, migration in enumerate(
+                SCHEMA_MIGRATIONS[version:], version + 1):
+            try:
+                conn.executescript(
+                    "BEGIN;" + migration(conn) +
+                    f"PRAGMA user_version = {new_version}; COMMIT;")
+            except sqlite3.Error:
+                #do not hand a half-applied migration back to the pool
+                conn.rollback()
+                raise
+
+
+def migrate_to_normalized_schema(conn):
+    '''Schema version 1. Books are stored once per Google volume in
+    Volumes, and SearchVolumes records which volumes each search
+    returned. Books is a view joining the two, with the old columns.
+    A database with the old Books and WikiResults tables is brought
+    forward
 
-    create_books = '''
-        CREATE TABLE IF NOT EXISTS "Books" (
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        the connection to the database
+
+    Returns
+    -------
+    string
+        the SQL script of the migration
+    '''
+    create_volumes = '''
+        CREATE TABLE IF NOT EXISTS "Volumes" (
+            "VolumeId"      TEXT PRIMARY KEY,
             "Title"         TEXT NOT NULL,
             "Subtitle"      TEXT NOT NULL,
             "Author"        TEXT NOT NULL,
@@ -207,29 +620,545 @@ def create_database():
             "Category"      TEXT NOT NULL,
             "Price"         TEXT NOT NULL,
             "AverageRating" REAL NOT NULL,
-            "RatingCount"   INT NOT NULL,
-            "Keyword"       TEXT NOT NULL,
-            PRIMARY KEY (Title, PublishedDate)
+            "RatingCount"   INT NOT NULL
         );
     '''
 
-    drop_wikiresults = '''
-        DROP TABLE IF EXISTS "WikiResults";
+    create_search_volumes = '''
+        CREATE TABLE IF NOT EXISTS "SearchVolumes" (
+            "Keyword"       TEXT NOT NULL,
+            "VolumeId"      TEXT NOT NULL REFERENCES Volumes(VolumeId),
+            "Rank"          INT NOT NULL,
+            PRIMARY KEY (Keyword, VolumeId)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS "SearchVolumesByVolume"
+            ON SearchVolumes(VolumeId);
+    '''
+
+    create_books = '''
+        CREATE VIEW IF NOT EXISTS "Books" AS
+        SELECT v.Title, v.Subtitle, v.Author, v.PublishedDate, v.Category,
+               v.Price, v.AverageRating, v.RatingCount, sv.Keyword,
+               v.VolumeId, sv.Rank
+        FROM SearchVolumes sv JOIN Volumes v ON v.VolumeId = sv.VolumeId;
     '''
 
     create_wikiresults = '''
         CREATE TABLE IF NOT EXISTS "WikiResults" (
-            "Title"       TEXT PRIMARY KEY,
+            "Title"       TEXT NOT NULL,
             "Url"         TEXT NOT NULL,
-            "SearchTerm"  TEXT NOT NULL
+            "SearchTerm"  TEXT NOT NULL,
+            PRIMARY KEY (SearchTerm, Title)
+        ) WITHOUT ROWID;
+    '''
+
+    migrate_legacy_schema = '''
+        ALTER TABLE "Books" RENAME TO "LegacyBooks";
+        ALTER TABLE "WikiResults" RENAME TO "LegacyWikiResults";
+    '''
+
+    copy_legacy_rows = '''
+        INSERT OR IGNORE INTO Volumes
+        SELECT Title || '|' || PublishedDate, Title, Subtitle, Author,
+               PublishedDate, Category, Price, AverageRating, RatingCount
+        FROM LegacyBooks;
+        INSERT OR IGNORE INTO SearchVolumes
+        SELECT Keyword, Title || '|' || PublishedDate, rowid
+        FROM LegacyBooks;
+        INSERT OR IGNORE INTO WikiResults
+        SELECT Title, Url, SearchTerm
+        FROM LegacyWikiResults;
+        DROP TABLE LegacyBooks;
+        DROP TABLE LegacyWikiResults;
+    '''
+
+    legacy = conn.execute('''
+        SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'Books'
+    ''').fetchone()
+    script = create_volumes + create_search_volumes + create_wikiresults
+    if legacy:
+        script = migrate_legacy_schema + script + copy_legacy_rows
+    return script + create_books
+
+
+def migrate_add_searches(conn):
+    '''Schema version 2. Searches records when each search term was
+    last fetched from an API and ingested, so repeated searches are
+    answered from the database. Searches already in the database are
+    recorded as fetched now
+
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        the connection to the database
+
+    Returns
+    -------
+    string
+        the SQL script of the migration
+    '''
+    create_searches = '''
+        CREATE TABLE IF NOT EXISTS "Searches" (
+            "Source"      TEXT NOT NULL,
+            "Term"        TEXT NOT NULL,
+            "FetchedAt"   REAL NOT NULL,
+            "ResultCount" INT NOT NULL,
+            PRIMARY KEY (Source, Term)
+        ) WITHOUT ROWID;
+    '''
+
+    record_existing_searches = '''
+        INSERT OR IGNORE INTO Searches
+        SELECT 'books', Keyword, CAST(strftime('%s', 'now') AS REAL), COUNT(*)
+        FROM SearchVolumes GROUP BY Keyword;
+        INSERT OR IGNORE INTO Searches
+        SELECT 'wiki', SearchTerm, CAST(strftime('%s', 'now') AS REAL), COUNT(*)
+        FROM WikiResults GROUP BY SearchTerm;
+    '''
+    return create_searches + record_existing_searches
+
+
+def migrate_canonical_terms(conn):
+    '''Schema version 3. Rewrites the Keyword and SearchTerm columns
+    and the Searches table to canonical search terms and author's
+    names, merging rows that only differed in spelling
+
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        the connection to the database
+
+    Returns
+    -------
+    string
+        the SQL script of the migration
+    '''
+    conn.create_function("canonical_query", 1, canonicalize_query)
+    conn.create_function("canonical_author", 1, canonicalize_author)
+    return '''
+        UPDATE OR REPLACE SearchVolumes SET Keyword = canonical_query(Keyword);
+        UPDATE OR REPLACE WikiResults SET SearchTerm = canonical_author(SearchTerm);
+        UPDATE OR REPLACE Searches SET Term = canonical_query(Term)
+        WHERE Source = 'books';
+        UPDATE OR REPLACE Searches SET Term = canonical_author(Term)
+        WHERE Source = 'wiki';
+    '''
+
+
+def migrate_nullable_fields(conn):
+    '''Schema version 4. Fields missing from the Google Books results
+    are stored as NULL instead of "No subtitle", "No author", "NA",
+    "No category" and 0, and Price becomes a number
+
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        the connection to the database
+
+    Returns
+    -------
+    string
+        the SQL script of the migration
+    '''
+    return '''
+        DROP VIEW IF EXISTS "Books";
+        CREATE TABLE "NullableVolumes" (
+            "VolumeId"      TEXT PRIMARY KEY,
+            "Title"         TEXT NOT NULL,
+            "Subtitle"      TEXT,
+            "Author"        TEXT,
+            "PublishedDate" TEXT,
+            "Category"      TEXT,
+            "Price"         REAL,
+            "AverageRating" REAL,
+            "RatingCount"   INT
         );
+        INSERT INTO NullableVolumes
+        SELECT VolumeId, Title, NULLIF(Subtitle, 'No subtitle'),
+               NULLIF(Author, 'No author'), NULLIF(PublishedDate, 'NA'),
+               NULLIF(Category, 'No category'), CAST(NULLIF(Price, 'NA') AS REAL),
+               NULLIF(AverageRating, 0), NULLIF(RatingCount, 0)
+        FROM Volumes;
+        DROP TABLE Volumes;
+        ALTER TABLE NullableVolumes RENAME TO Volumes;
+        CREATE VIEW "Books" AS
+        SELECT v.Title, v.Subtitle, v.Author, v.PublishedDate, v.Category,
+               v.Price, v.AverageRating, v.RatingCount, sv.Keyword,
+               v.VolumeId, sv.Rank
+        FROM SearchVolumes sv JOIN Volumes v ON v.VolumeId = sv.VolumeId;
+    '''
+
+
+def migrate_add_aggregates(conn):
+    '''Schema version 5. Summary tables for the corpus report, kept up
+    to date by triggers on Volumes, so the report never scans it:
+    books per category, books and ratings per author, and histograms
+    of average ratings (half-star buckets) and prices (PRICE_BUCKET
+    wide buckets). They are filled from the books already stored
+
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        the connection to the database
+
+    Returns
+    -------
+    string
+        the SQL script of the migration
+    '''
+    create_aggregates = f'''
+        CREATE TABLE IF NOT EXISTS "CategoryStats" (
+            "Category"    TEXT PRIMARY KEY,
+            "Books"       INT NOT NULL
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS "AuthorStats" (
+            "Author"      TEXT PRIMARY KEY,
+            "Books"       INT NOT NULL,
+            "Ratings"     INT NOT NULL,
+            "RatingSum"   REAL NOT NULL
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS "AuthorStatsByRatings"
+            ON AuthorStats(Ratings);
+        CREATE TABLE IF NOT EXISTS "RatingHistogram" (
+            "Bucket"      REAL PRIMARY KEY,
+            "Books"       INT NOT NULL
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS "PriceHistogram" (
+            "Bucket"      REAL PRIMARY KEY,
+            "Books"       INT NOT NULL
+        ) WITHOUT ROWID;
+    '''
+
+    fill_aggregates = f'''
+        INSERT INTO CategoryStats
+        SELECT COALESCE(Category, 'No category'), COUNT(*)
+        FROM Volumes GROUP BY 1;
+        INSERT INTO AuthorStats
+        SELECT Author, COUNT(*), TOTAL(RatingCount),
+               TOTAL(AverageRating * RatingCount)
+        FROM Volumes WHERE Author IS NOT NULL GROUP BY Author;
+        INSERT INTO RatingHistogram
+        SELECT CAST(AverageRating * 2 AS INT) / 2.0, COUNT(*)
+        FROM Volumes WHERE AverageRating IS NOT NULL GROUP BY 1;
+        INSERT INTO PriceHistogram
+        SELECT CAST(Price / {PRICE_BUCKET} AS INT) * {PRICE_BUCKET}.0, COUNT(*)
+        FROM Volumes WHERE Price IS NOT NULL GROUP BY 1;
+    '''
+
+    def add(row):
+        return f'''
+            INSERT INTO CategoryStats
+            VALUES (COALESCE({row}.Category, 'No category'), 1)
+            ON CONFLICT (Category) DO UPDATE SET Books = Books + 1;
+            INSERT INTO AuthorStats
+            SELECT {row}.Author, 1, COALESCE({row}.RatingCount, 0),
+                   COALESCE({row}.AverageRating * {row}.RatingCount, 0)
+            WHERE {row}.Author IS NOT NULL
+            ON CONFLICT (Author) DO UPDATE SET
+                Books = Books + 1,
+                Ratings = Ratings + excluded.Ratings,
+                RatingSum = RatingSum + excluded.RatingSum;
+            INSERT INTO RatingHistogram
+            SELECT CAST({row}.AverageRating * 2 AS INT) / 2.0, 1
+            WHERE {row}.AverageRating IS NOT NULL
+            ON CONFLICT (Bucket) DO UPDATE SET Books = Books + 1;
+            INSERT INTO PriceHistogram
+            SELECT CAST({row}.Price / {PRICE_BUCKET} AS INT) * {PRICE_BUCKET}.0, 1
+            WHERE {row}.Price IS NOT NULL
+            ON CONFLICT (Bucket) DO UPDATE SET Books = Books + 1;
+        '''
+
+    def remove(row):
+        return f'''
+            UPDATE CategoryStats SET Books = Books - 1
+            WHERE Category = COALESCE({row}.Category, 'No category');
+            UPDATE AuthorStats SET
+                Books = Books - 1,
+                Ratings = Ratings - COALESCE({row}.RatingCount, 0),
+                RatingSum = RatingSum - COALESCE({row}.AverageRating * {row}.RatingCount, 0)
+            WHERE Author = {row}.Author;
+            UPDATE RatingHistogram SET Books = Books - 1
+            WHERE Bucket = CAST({row}.AverageRating * 2 AS INT) / 2.0;
+            UPDATE PriceHistogram SET Books = Books - 1
+            WHERE Bucket = CAST({row}.Price / {PRICE_BUCKET} AS INT) * {PRICE_BUCKET}.0;
+        '''
+
+    create_triggers = f'''
+        CREATE TRIGGER IF NOT EXISTS "VolumesAggregateInsert"
+        AFTER INSERT ON Volumes BEGIN {add("NEW")} END;
+        CREATE TRIGGER IF NOT EXISTS "VolumesAggregateDelete"
+        AFTER DELETE ON Volumes BEGIN {remove("OLD")} END;
+        CREATE TRIGGER IF NOT EXISTS "VolumesAggregateUpdate"
+        AFTER UPDATE ON Volumes BEGIN {remove("OLD")} {add("NEW")} END;
     '''
-    cur.execute(drop_books)
-    cur.execute(create_books)
-    cur.execute(drop_wikiresults)
-    cur.execute(create_wikiresults)
+    return create_aggregates + fill_aggregates + create_triggers
 
-    conn.commit()
+
+def migrate_add_full_text_index(conn):
+    '''Schema version 6. An FTS5 index over the Title, Subtitle, Author
+    and Category of every stored book, for searching the database
+    before the API. It indexes Volumes in place (external content),
+    is kept up to date by triggers and is filled from the books
+    already stored
+
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        the connection to the database
+
+    Returns
+    -------
+    string
+        the SQL script of the migration
+    '''
+    columns = "Title, Subtitle, Author, Category"
+    new_values = "NEW.Title, NEW.Subtitle, NEW.Author, NEW.Category"
+    old_values = "OLD.Title, OLD.Subtitle, OLD.Author, OLD.Category"
+    return f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS "VolumesSearch" USING fts5(
+            {columns},
+            content='Volumes', content_rowid='rowid',
+            tokenize='unicode61 remove_diacritics 2'
+        );
+        INSERT INTO VolumesSearch(VolumesSearch) VALUES ('rebuild');
+        CREATE TRIGGER IF NOT EXISTS "VolumesSearchInsert"
+        AFTER INSERT ON Volumes BEGIN
+            INSERT INTO VolumesSearch(rowid, {columns})
+            VALUES (NEW.rowid, {new_values});
+        END;
+        CREATE TRIGGER IF NOT EXISTS "VolumesSearchDelete"
+        AFTER DELETE ON Volumes BEGIN
+            INSERT INTO VolumesSearch(VolumesSearch, rowid, {columns})
+            VALUES ('delete', OLD.rowid, {old_values});
+        END;
+        CREATE TRIGGER IF NOT EXISTS "VolumesSearchUpdate"
+        AFTER UPDATE ON Volumes BEGIN
+            INSERT INTO VolumesSearch(VolumesSearch, rowid, {columns})
+            VALUES ('delete', OLD.rowid, {old_values});
+            INSERT INTO VolumesSearch(rowid, {columns})
+            VALUES (NEW.rowid, {new_values});
+        END;
+    '''
+
+
+def migrate_exhausted_searches(conn):
+    '''Schema version 7. Searches records whether a search saved every
+    result the API has, so a search with fewer results than requested
+    still counts as ingested
+
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        the connection to the database
+
+    Returns
+    -------
+    string
+        the SQL script of the migration
+    '''
+    return '''
+        ALTER TABLE Searches ADD COLUMN "Exhausted" INT NOT NULL DEFAULT 0;
+    '''
+
+
+SCHEMA_MIGRATIONS = [
+    migrate_to_normalized_schema,
+    migrate_add_searches,
+    migrate_canonical_terms,
+    migrate_nullable_fields,
+    migrate_add_aggregates,
+    migrate_add_full_text_index,
+    migrate_exhausted_searches,
+]
+
+
+def is_search_ingested(source, term, ttl=None, min_results=0):
+    '''Checks whether at least min_results results for a search term,
+    or every result if the search has fewer, are already in the
+    database and were fetched less than ttl seconds ago
+
+    Parameters
+    ----------
+    source: string
+        'books' for Google Books or 'wiki' for Wikipedia
+    term: string
+        the search term or author's name
+    ttl: float
+        seconds before ingested results are refetched, None for never
+    min_results: int
+        the least number of results saved
+
+    Returns
+    -------
+    bool
+        True if the search can be answered from the database
+    '''
+    rows = queries.fetchall(
+        get_db_session(), queries.SEARCH_STATUS, (source, term))
+    if not rows:
+        return False
+    fetched_at, result_count, exhausted = rows[0]
+    if result_count < min_results and not exhausted:
+        return False
+    return ttl is None or time.time() - fetched_at < ttl
+
+
+def mark_search_ingested(source, term, result_count, exhausted=False,
+                         fetched_at=None):
+    '''Records that the results for a search term were fetched and
+    saved to the database
+
+    Parameters
+    ----------
+    source: string
+        'books' for Google Books or 'wiki' for Wikipedia
+    term: string
+        the search term or author's name
+    result_count: int
+        the number of records saved
+    exhausted: bool
+        whether every result the API has was saved
+    fetched_at: float
+        when the results were fetched, now if None
+
+    Returns
+    -------
+    none
+    '''
+    if fetched_at is None:
+        fetched_at = time.time()
+    with get_db_session().transaction() as conn:
+        queries.executemany(conn, queries.UPSERT_SEARCH,
+                            [(source, term, fetched_at, result_count, exhausted)])
+
+
+class DatabaseSession:
+    '''Thread-safe pool of long-lived connections to the database.
+    Every connection is configured with DB_PRAGMAS once when it is
+    opened and keeps its compiled statements in sqlite3's statement
+    cache, so the query helpers pay neither connect nor parse costs
+
+    Parameters
+    ----------
+    filename: string
+        the name of the database file
+    pool_size: int
+        the most connections open at the same time
+    cached_statements: int
+        the number of compiled statements kept per connection
+    '''
+    def __init__(self, filename, pool_size=DB_POOL_SIZE,
+                 cached_statements=queries.STATEMENT_CACHE_SIZE):
+        self.filename = filename
+        self.pool_size = pool_size
+        self.cached_statements = cached_statements
+        self.idle = queue.LifoQueue()
+        self.opened = 0
+        self.lock = threading.Lock()
+
+    def connect(self):
+        '''Opens and configures a new connection'''
+        conn = sqlite3.connect(self.filename, check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        for pragma, value in DB_PRAGMAS.items():
+            conn.execute(f"PRAGMA {pragma}={value}")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        '''Borrows a connection from the pool for the duration of a
+        with block, opening one if the pool is not full yet'''
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                can_open = self.opened < self.pool_size
+                if can_open:
+                    self.opened += 1
+            conn = self.connect() if can_open else self.idle.get()
+        try:
+            yield conn
+        finally:
+            self.idle.put(conn)
+
+    @contextmanager
+    def transaction(self):
+        '''Borrows a connection and commits everything executed on it
+        in the with block as one transaction, or rolls it back'''
+        with self.connection() as conn:
+            with conn:
+                yield conn
+
+    @contextmanager
+    def snapshot(self):
+        '''Borrows a connection for a with block whose reads all run in
+        one read transaction, so they see the same state of the database
+        even while other threads write'''
+        with self.connection() as conn:
+            conn.execute("BEGIN")
+            try:
+                yield SnapshotSession(conn)
+            finally:
+                conn.rollback()
+
+    def fetchall(self, query, params=()):
+        '''Runs a read query and returns all rows'''
+        with self.connection() as conn:
+            return conn.execute(query, params).fetchall()
+
+    def executemany(self, query, rows):
+        '''Runs a write query for every row in one transaction and
+        returns the number of changed rows'''
+        with self.transaction() as conn:
+            return conn.executemany(query, rows).rowcount
+
+    def close(self):
+        '''Closes every idle connection'''
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+            with self.lock:
+                self.opened -= 1
+
+
+class SnapshotSession:
+    '''The session handed out by DatabaseSession.snapshot(): the query
+    helpers run on its one connection, inside its read transaction
+
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        the borrowed connection
+    '''
+    def __init__(self, conn):
+        self.conn = conn
+
+    @contextmanager
+    def connection(self):
+        yield self.conn
+
+    def fetchall(self, query, params=()):
+        return self.conn.execute(query, params).fetchall()
+
+
+def get_db_session():
+    '''Returns the shared database session, creating it on first use
+
+    Parameters
+    ----------
+    none
+
+    Returns
+    -------
+    DatabaseSession
+        the shared database session
+    '''
+    global DB_SESSION
+    if DB_SESSION is None:
+        DB_SESSION = DatabaseSession(DB_FILENAME)
+    return DB_SESSION
 
 
 def insert_record_to_books(record_list):
@@ -245,14 +1174,46 @@ def insert_record_to_books(record_list):
     -------
     none
     '''
-    conn = sqlite3.connect("finalproject.sqlite")
-    cur = conn.cursor()
-    insert_books = '''
-        INSERT INTO Books
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    insert_records_to_books([record_list])
+
+
+def insert_records_to_books(records, start_rank=0, replace=False):
+    '''Upsert a page of records retrieved from Google Books API into
+    the Volumes and SearchVolumes tables in one transaction. Volumes
+    already in the database are updated, so repeated or overlapping
+    searches never fail
+
+    Parameters
+    ----------
+    records: list
+        a list of BookRecord, in the order the API returned them
+    start_rank: int
+        the position of each keyword's first record in its search results
+    replace: bool
+        whether the earlier results of the records' keywords are dropped
+        first, when these records start a new ingest of the search
+
+    Returns
+    -------
+    int
+        the number of records written
     '''
-    cur.execute(insert_books, record_list)
-    conn.commit()
+    volumes = [record[:8] + (record.volume_id,) for record in records]
+    search_volumes = []
+    ranks = {}
+    for record in records:
+        rank = ranks.get(record.keyword, start_rank)
+        ranks[record.keyword] = rank + 1
+        search_volumes.append((record.keyword, record.volume_id, rank))
+    with metrics.span("db.insert_books"), get_db_session().transaction() as conn:
+        if replace:
+            queries.executemany(conn, queries.DELETE_SEARCH_VOLUMES,
+                                [(keyword,) for keyword in ranks])
+        queries.executemany(conn, queries.UPSERT_VOLUMES, volumes)
+        written = queries.executemany(
+            conn, queries.UPSERT_SEARCH_VOLUMES, search_volumes)
+    metrics.count("db.books_inserted", len(volumes))
+    return written
 
 
 def insert_record_to_wikiresults(record_list):
@@ -268,100 +1229,896 @@ def insert_record_to_wikiresults(record_list):
     -------
     none
     '''
-    conn = sqlite3.connect("finalproject.sqlite")
-    cur = conn.cursor()
-    insert_wikiresults = '''
-        INSERT INTO WikiResults
-        VALUES (?, ?, ?)
+    insert_records_to_wikiresults([record_list])
+
+
+def insert_records_to_wikiresults(records):
+    '''Upsert the records retrieved from one Wikipedia API call
+    into the WikiResults table with one executemany in one transaction
+
+    Parameters
+    ----------
+    records: list
+        a list of extracted records
+
+    Returns
+    -------
+    int
+        the number of records inserted
+    '''
+    with metrics.span("db.insert_wikiresults"), get_db_session().transaction() as conn:
+        written = queries.executemany(conn, queries.UPSERT_WIKIRESULTS, records)
+    metrics.count("db.wikiresults_inserted", len(records))
+    return written
+
+
+def split_book_cache_key(key):
+    '''Splits a Google Books cache key into its search term and the
+    start index of the page, the inverse of the key get_google_books
+    builds
+
+    Parameters
+    ----------
+    key: string
+        the cache key, "term" or "term|start=25"
+
+    Returns
+    -------
+    tuple
+        the search term and the start index
+    '''
+    search_term, separator, start = key.rpartition("|start=")
+    if separator and start.isdigit():
+        return search_term, int(start)
+    return key, 0
+
+
+def backfill_books_from_cache(batch_size=1000):
+    '''Ingests every cached Google Books response into the database,
+    batch_size records per transaction, and reports the throughput.
+    Every page is ranked from its start index, and every search is
+    marked as ingested when its response was cached, so it is not
+    fetched again before it expires
+
+    Parameters
+    ----------
+    batch_size: int
+        the number of records written per transaction
+
+    Returns
+    -------
+    dict
+        the number of records inserted, seconds spent and rows per second
+    '''
+    start = time.perf_counter()
+    inserted = 0
+    #records by the start index of their page, the rank of the first
+    batches = {}
+    searches = {}
+    for key, book_result, stored_at in open_cache_store(CACHE_BOOK_FILENAME).iter_entries():
+        search_term, start_index = split_book_cache_key(key)
+        search_term = canonicalize_query(search_term)
+        items = book_result.get('items', [])
+        batch = batches.setdefault(start_index, [])
+        for result in items:
+            batch.append(create_book_record(result, search_term))
+        if len(batch) >= batch_size:
+            inserted += insert_records_to_books(batch, start_rank=start_index)
+            batch.clear()
+        saved, exhausted, fetched_at = searches.get(search_term, (0, False, stored_at))
+        exhausted = (exhausted or len(items) < GOOGLE_BOOKS_PAGE_SIZE
+                     or start_index + len(items) >= book_result.get('totalItems', 0))
+        searches[search_term] = (saved + len(items), exhausted,
+                                 min(fetched_at, stored_at))
+    for start_index, batch in batches.items():
+        if batch:
+            inserted += insert_records_to_books(batch, start_rank=start_index)
+    for search_term, (saved, exhausted, fetched_at) in searches.items():
+        if not is_search_ingested('books', search_term, CACHE_BOOK_TTL):
+            mark_search_ingested('books', search_term, saved, exhausted, fetched_at)
+    seconds = time.perf_counter() - start
+    report = {
+        "rows": inserted,
+        "seconds": seconds,
+        "rows_per_second": inserted / seconds if seconds else 0.0,
+    }
+    print(f"Inserted {inserted} records in {seconds:.2f}s "
+          f"({report['rows_per_second']:.0f} rows/s)")
+    return report
+
+
+class SqliteCacheStore:
+    '''Persistent key/value store for cached API responses backed by
+    SQLite. Every entry is its own row, so saving a new response is a
+    single small transaction instead of a rewrite of the whole cache,
+    and an interrupted write never corrupts the entries already stored
+
+    Parameters
+    ----------
+    filename: string
+        the name of the SQLite file holding the cache
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(filename, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS "Cache" (
+                "Key"       TEXT PRIMARY KEY,
+                "Value"     TEXT NOT NULL,
+                "StoredAt"  REAL NOT NULL
+            );
+        ''')
+        self.conn.commit()
+
+    def get(self, key, default=None):
+        '''Returns the cached value for key, or default if missing'''
+        entry = self.get_entry(key)
+        if entry is None:
+            return default
+        return entry[0]
+
+    def get_entry(self, key):
+        '''Returns (value, stored_at) for key, or None if missing'''
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT Value, StoredAt FROM Cache WHERE Key = ?',
+                (key,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def put(self, key, value):
+        '''Stores value under key in its own transaction'''
+        self.put_many([(key, value)])
+
+    def put_many(self, items):
+        '''Stores several (key, value) pairs in one transaction'''
+        now = time.time()
+        rows = [(key, json.dumps(value), now) for key, value in items]
+        with self.lock:
+            with self.conn:
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO Cache VALUES (?, ?, ?)', rows)
+
+    def items(self):
+        '''Returns all (key, value) pairs in the store'''
+        return list(self.iter_items())
+
+    def iter_items(self, batch_size=500):
+        '''Yields all (key, value) pairs, batch_size rows at a time'''
+        for key, value, stored_at in self.iter_entries(batch_size):
+            yield key, value
+
+    def iter_entries(self, batch_size=500):
+        '''Yields all (key, value, stored_at) entries, batch_size rows
+        at a time'''
+        last_key = None
+        while True:
+            with self.lock:
+                if last_key is None:
+                    rows = self.conn.execute(
+                        'SELECT Key, Value, StoredAt FROM Cache ORDER BY Key LIMIT ?',
+                        (batch_size,)).fetchall()
+                else:
+                    rows = self.conn.execute(
+                        'SELECT Key, Value, StoredAt FROM Cache WHERE Key > ? '
+                        'ORDER BY Key LIMIT ?',
+                        (last_key, batch_size)).fetchall()
+            if not rows:
+                return
+            for key, value, stored_at in rows:
+                yield key, json.loads(value), stored_at
+            last_key = rows[-1][0]
+
+    def key_version(self):
+        '''Returns the version of the key format the store is in'''
+        with self.lock:
+            return self.conn.execute('PRAGMA user_version').fetchone()[0]
+
+    def rekey(self, key_function, version):
+        '''Moves every entry to key_function(key) in one transaction
+        and records the new key format version. When several keys map
+        to one, the most recently stored entry is kept
+
+        Parameters
+        ----------
+        key_function: function
+            maps an old key to the new one
+        version: int
+            the version of the new key format
+
+        Returns
+        -------
+        int
+            the number of entries moved
+        '''
+        moved = 0
+        with self.lock:
+            with self.conn:
+                keys = [row[0] for row in self.conn.execute('SELECT Key FROM Cache')]
+                for key in keys:
+                    new_key = key_function(key)
+                    if new_key == key:
+                        continue
+                    self.conn.execute('''
+                        INSERT INTO Cache SELECT ?, Value, StoredAt FROM Cache
+                        WHERE Key = ?
+                        ON CONFLICT(Key) DO UPDATE SET
+                            Value = excluded.Value, StoredAt = excluded.StoredAt
+                        WHERE excluded.StoredAt > Cache.StoredAt
+                    ''', (new_key, key))
+                    self.conn.execute('DELETE FROM Cache WHERE Key = ?', (key,))
+                    moved += 1
+                self.conn.execute(f'PRAGMA user_version = {int(version)}')
+        return moved
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM Cache').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+CACHE_BACKENDS = {
+    "sqlite": (SqliteCacheStore, ".sqlite"),
+}
+
+
+def open_cache_store(cache_filename):
+    '''Opens (once per process) the persistent store that backs a cache
+    file, migrating the legacy JSON cache into it the first time and
+    moving entries stored before CACHE_KEY_VERSION to canonical keys
+
+    Parameters
+    ----------
+    cache_filename: string
+        The name of the legacy JSON cache file
+
+    Returns
+    -------
+    object
+        the cache store for the configured CACHE_BACKEND
+    '''
+    if cache_filename not in CACHE_STORES:
+        store_class, extension = CACHE_BACKENDS[CACHE_BACKEND]
+        store_filename = os.path.splitext(cache_filename)[0] + extension
+        store = store_class(store_filename)
+        migrate_json_cache(store, cache_filename)
+        if store.key_version() < CACHE_KEY_VERSION:
+            store.rekey(lambda key: canonical_cache_key(cache_filename, key),
+                        CACHE_KEY_VERSION)
+        CACHE_STORES[cache_filename] = store
+    return CACHE_STORES[cache_filename]
+
+
+def migrate_json_cache(store, cache_filename):
+    '''Copies the entries of a legacy JSON cache file into the store
+    under canonical keys, then renames the JSON file so the migration
+    only happens once
+
+    Parameters
+    ----------
+    store: object
+        the cache store to fill
+    cache_filename: string
+        The name of the legacy JSON cache file
+
+    Returns
+    -------
+    int
+        the number of migrated entries
     '''
-    cur.execute(insert_wikiresults, record_list)
-    conn.commit()
+    if not os.path.exists(cache_filename):
+        return 0
+    try:
+        with open(cache_filename, 'r') as cache_file:
+            cache_dict = json.load(cache_file)
+    except ValueError:
+        cache_dict = {}
+    store.put_many((canonical_cache_key(cache_filename, key), value)
+                   for key, value in cache_dict.items())
+    os.replace(cache_filename, cache_filename + ".migrated")
+    return len(cache_dict)
+
+
+def canonical_cache_key(cache_filename, key):
+    '''Brings a key of the cache in cache_filename to the form
+    get_wiki_results or get_google_books looks it up by: the canonical
+    author's name, or the canonical search term with its page
+
+    Parameters
+    ----------
+    cache_filename: string
+        The name of the legacy JSON cache file
+    key: string
+        the cache key
+
+    Returns
+    -------
+    string
+        the canonical cache key
+    '''
+    if cache_filename == CACHE_WIKI_FILENAME:
+        return canonicalize_author(key)
+    search_term, start_index = split_book_cache_key(key)
+    search_term = canonicalize_query(search_term)
+    if start_index == 0:
+        return search_term
+    return f"{search_term}|start={start_index}"
+
+
+def normalize_cache_key(key):
+    '''Normalizes a search term so that lookups differing only in
+    case or spacing share one cache entry
+
+    Parameters
+    ----------
+    key: string
+        the search term or author's name
+
+    Returns
+    -------
+    string
+        the normalized cache key
+    '''
+    return ' '.join(key.split()).casefold()
+
+
+def canonicalize_query(term):
+    '''Brings a search term to its canonical form, so that spellings of
+    the same search share one cache entry, API call and Keyword: Unicode
+    compatibility forms and curly quotes are normalized, case is folded,
+    spacing is collapsed, and aliases are replaced with their target
+
+    Parameters
+    ----------
+    term: string
+        the search term
+
+    Returns
+    -------
+    string
+        the canonical search term
+    '''
+    term = fold_query(term)
+    return load_query_aliases().get(term, term)
+
 
+def fold_query(term):
+    '''Normalizes Unicode forms and quotes, folds case and collapses
+    spacing of a search term, without applying aliases'''
+    term = unicodedata.normalize('NFKC', term).translate(QUOTE_TRANSLATION)
+    return ' '.join(term.split()).casefold()
 
-def load_cache(cache_filename):
-    '''Opens the cache file if it exists and loads the JSON into dictionary.
-    If the cache file doesn't exist, creates a new cache dictionary
+
+def canonicalize_author(name):
+    '''Brings an author's name to its canonical form: "Last, First" is
+    reordered to "First Last", unless what follows the comma is a
+    suffix in NAME_SUFFIXES ("Kurt Vonnegut, Jr."), and initials are
+    spaced ("J.R.R." and "J. R. R." match) before the search term
+    canonicalization
+
+    Parameters
+    ----------
+    name: string
+        the author's name
+
+    Returns
+    -------
+    string
+        the canonical name
+    '''
+    name = unicodedata.normalize('NFKC', name)
+    if name.count(',') == 1:
+        last, first = name.split(',')
+        suffix = first.replace('.', '').strip().casefold()
+        if suffix and suffix not in NAME_SUFFIXES:
+            name = f"{first} {last}"
+    name = re.sub(r'(\w)\.(?=\w)', r'\1. ', name)
+    return canonicalize_query(name)
+
+
+def load_query_aliases():
+    '''Loads the alias table from ALIASES_FILENAME on first use. The
+    file maps alternative search terms to the term they stand for,
+    e.g. {"hp1": "Harry Potter and the Philosopher's Stone"}
+
+    Parameters
+    ----------
+    none
+
+    Returns
+    -------
+    dict
+        folded alias to folded target
+    '''
+    global QUERY_ALIASES
+    if QUERY_ALIASES is None:
+        try:
+            with open(ALIASES_FILENAME, 'r') as aliases_file:
+                aliases = json.load(aliases_file)
+        except (OSError, ValueError):
+            aliases = {}
+        QUERY_ALIASES = {fold_query(alias): fold_query(target)
+                         for alias, target in aliases.items()}
+    return QUERY_ALIASES
+
+
+class SingleFlight:
+    '''Coalesces concurrent calls for the same key: the first caller runs
+    the function, and callers arriving while it runs wait for and share
+    its result (or its exception) instead of running it again
+    '''
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, function):
+        '''Runs function() unless a call for key is already running
+
+        Parameters
+        ----------
+        key: string
+            identifies identical calls
+        function: function
+            called without arguments
+
+        Returns
+        -------
+        tuple
+            the result and whether it was shared from another caller
+        '''
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Future()
+        if not leader:
+            return call.result(), True
+        try:
+            result = function()
+            call.set_result(result)
+            return result, False
+        except BaseException as error:
+            call.set_exception(error)
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+
+class TieredCache:
+    '''Two-tier cache: a bounded LRU dictionary in memory in front of a
+    persistent cache store. Nothing is read at startup; a memory miss
+    fetches a single entry through the store's index on the normalized
+    key. Entries older than ttl seconds are stale: they are refetched,
+    or, with stale_while_revalidate, served once more while a background
+    thread refreshes them. Only one fetch per key is ever outstanding;
+    concurrent lookups of the same key wait for it and share its result
+
+    Parameters
+    ----------
+    store: object
+        the cache store to read from and write to
+    ttl: float
+        seconds before an entry is stale, None to never expire
+    max_entries: int
+        the most entries kept in memory
+    stale_while_revalidate: bool
+        whether stale entries are served while being refreshed
+    '''
+    def __init__(self, store, ttl=None, max_entries=CACHE_MEMORY_ENTRIES,
+                 stale_while_revalidate=False):
+        self.store = store
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stale_while_revalidate = stale_while_revalidate
+        self.memory = OrderedDict()
+        self.pending = {}
+        self.refreshing = set()
+        self.flights = SingleFlight()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stale": 0, "evictions": 0,
+                      "coalesced": 0}
+
+    def count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def is_fresh(self, stored_at):
+        return self.ttl is None or time.time() - stored_at < self.ttl
+
+    def lookup(self, key):
+        '''Returns (value, stored_at) for a normalized key from memory,
+        falling back to the store, or None if missing'''
+        with self.lock:
+            if key in self.pending:
+                return self.pending[key]
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return self.memory[key]
+        entry = self.store.get_entry(key)
+        if entry is not None:
+            self.remember(key, entry)
+        return entry
+
+    def remember(self, key, entry):
+        '''Adds an entry to the memory tier, evicting the least
+        recently used entries beyond max_entries'''
+        with self.lock:
+            self.memory[key] = entry
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
+                self.stats["evictions"] += 1 # already holding the lock
+
+    def get_or_fetch(self, key, fetch, allow_stale=True):
+        '''Returns the cached value for key, calling fetch() and storing
+        its result on a miss or an expired entry
+
+        Parameters
+        ----------
+        key: string
+            the search term or author's name
+        fetch: function
+            called without arguments to obtain a fresh value
+        allow_stale: bool
+            whether an expired entry may be served while it is refreshed,
+            with stale_while_revalidate; False waits for the fresh value
+
+        Returns
+        -------
+        dict
+            the cached or fetched value
+        '''
+        key = normalize_cache_key(key)
+        entry = self.lookup(key)
+        if entry is not None and self.is_fresh(entry[1]):
+            self.count("hits")
+            return entry[0]
+        if entry is not None and self.stale_while_revalidate and allow_stale:
+            self.count("stale")
+            self.refresh_in_background(key, fetch)
+            return entry[0]
+        value, shared = self.flights.do(
+            key, lambda: self.fetch_and_put(key, fetch))
+        self.count("coalesced" if shared else "misses")
+        return value
+
+    def fetch_and_put(self, key, fetch):
+        '''Fetches and stores the value for a normalized key, unless
+        a fetch that finished just before already stored a fresh one'''
+        entry = self.lookup(key)
+        if entry is not None and self.is_fresh(entry[1]):
+            return entry[0]
+        value = fetch()
+        self.put(key, value)
+        return value
+
+    def refresh_in_background(self, key, fetch):
+        '''Refetches a stale entry on a daemon thread, once per key'''
+        with self.lock:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+
+        def refresh():
+            try:
+                self.flights.do(key, lambda: self.fetch_and_put(key, fetch))
+            except Exception:
+                pass # keep serving the stale entry
+            finally:
+                with self.lock:
+                    self.refreshing.discard(key)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    def put(self, key, value):
+        '''Stores value in memory and appends it to the persistent
+        store, whose writes are serialized by its own lock'''
+        key = normalize_cache_key(key)
+        self.remember(key, (value, time.time()))
+        self.store.put(key, value)
+
+    def __contains__(self, key):
+        entry = self.lookup(normalize_cache_key(key))
+        return entry is not None and self.is_fresh(entry[1])
+
+    def __getitem__(self, key):
+        entry = self.lookup(normalize_cache_key(key))
+        if entry is None:
+            raise KeyError(key)
+        return entry[0]
+
+    def __setitem__(self, key, value):
+        key = normalize_cache_key(key)
+        with self.lock:
+            self.pending[key] = (value, time.time())
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __len__(self):
+        return len(self.store) + len(self.pending)
+
+    def flush(self):
+        '''Appends the entries added with [] to the store'''
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for key, entry in pending.items():
+            self.remember(key, entry)
+        if pending:
+            self.store.put_many(
+                (key, value) for key, (value, _) in pending.items())
+
+
+def load_cache(cache_filename, ttl=None):
+    '''Opens the persistent cache store for the cache file and puts a
+    bounded in-memory TieredCache in front of it, so startup cost does
+    not grow with the cache size. A legacy JSON cache file is migrated
+    into the store on first use
     
     Parameters
     ----------
     cache_filename: string
         The name of the cache file
+    ttl: float
+        seconds before an entry is stale, None to never expire
     
     Returns
     -------
-    dict
+    TieredCache
         The opened cache
     '''
-    try:
-        cache_file = open(cache_filename, 'r')
-        cache_contents = cache_file.read()
-        cache_dict = json.loads(cache_contents)
-        cache_file.close()
-    except:
-        cache_dict = {}
-    return cache_dict
+    return TieredCache(open_cache_store(cache_filename), ttl,
+                       stale_while_revalidate=CACHE_STALE_WHILE_REVALIDATE)
+
 
+def open_caches():
+    '''Opens the Google Books and Wikipedia caches into the module
+    globals, unless they are already open
+
+    Parameters
+    ----------
+    none
 
-def save_cache(cache_dict, cache_filename):
-    ''' Saves the current state of the cache to disk
+    Returns
+    -------
+    none
+    '''
+    global CACHE_BOOK_DICT, CACHE_WIKI_DICT
+    if not isinstance(CACHE_BOOK_DICT, TieredCache):
+        CACHE_BOOK_DICT = load_cache(CACHE_BOOK_FILENAME, CACHE_BOOK_TTL)
+    if not isinstance(CACHE_WIKI_DICT, TieredCache):
+        CACHE_WIKI_DICT = load_cache(CACHE_WIKI_FILENAME, CACHE_WIKI_TTL)
+
+
+def cache_stats():
+    '''Returns the hit, miss, stale, coalesced and eviction counters
+    of both caches
+
+    Parameters
+    ----------
+    none
+
+    Returns
+    -------
+    dict
+        counters keyed by cache name
+    '''
+    open_caches()
+    return {
+        "google_books": dict(CACHE_BOOK_DICT.stats),
+        "wiki": dict(CACHE_WIKI_DICT.stats),
+    }
+
+
+def cache_counters():
+    '''Returns the counters of the open caches for the metrics dump,
+    as "cache.<name>.<counter>"
+
+    Parameters
+    ----------
+    none
+
+    Returns
+    -------
+    dict
+        counters by metric name
+    '''
+    counters = {}
+    for name, cache in (("google_books", CACHE_BOOK_DICT), ("wiki", CACHE_WIKI_DICT)):
+        if isinstance(cache, TieredCache):
+            for stat, value in cache.stats.items():
+                counters[f"cache.{name}.{stat}"] = value
+    return counters
+
+
+metrics.register_collector(cache_counters)
+
+
+def save_cache(cache_dict, cache_filename, key=None):
+    ''' Saves the cache to the persistent store. A TieredCache appends
+    only its new entries; for a plain dict, only key is appended when
+    given, otherwise every entry is written
     
     Parameters
     ----------
-    cache_dict: dict
-        The dictionary to save
+    cache_dict: dict or TieredCache
+        The cache to save
     cache_filename: string
         The name of the cache file
+    key: string
+        The entry that changed, if known
     
     Returns
     -------
     none
     '''
-    dumped_json_cache = json.dumps(cache_dict)
-    fw = open(cache_filename,"w")
-    fw.write(dumped_json_cache)
-    fw.close()
+    if isinstance(cache_dict, TieredCache):
+        cache_dict.flush()
+        return
+    store = open_cache_store(cache_filename)
+    if key is None:
+        store.put_many(
+            (normalize_cache_key(k), value) for k, value in cache_dict.items())
+    else:
+        store.put(normalize_cache_key(key), cache_dict[key])
 
 
-def print_inspired_list():
+def print_inspired_list(titles=None):
     '''Prints titles in INSPITED_TITLE_LIST as a numbered list
 
     Parameters
     ----------
-    none
+    titles: list
+        the titles to print, INSPIRED_TITLE_LIST if None
+
+    Returns
+    -------
+    none
+    '''
+    i = 1
+    for title in titles or INSPIRED_TITLE_LIST:
+        print(f"{i}. {title}")
+        i += 1
+
+
+def extract_book_from_database(user_input):
+    '''Extracts relevant records from the Books table in database
+
+    Parameters
+    ----------
+    user_input: string
+        the search term inputted
+    
+    Returns
+    -------
+    list
+        a list of tuples that contains the extracted records
+    '''
+    user_input = canonicalize_query(user_input)
+    with metrics.span("db.extract_books"):
+        return queries.fetchall(
+            get_db_session(), queries.BOOKS_BY_KEYWORD, (user_input,))
+
+
+def full_text_query(search_term):
+    '''Turns a search term into an FTS5 query matching books that
+    contain every word of it, the last word also as a prefix unless it
+    is shorter than LOCAL_PREFIX_MIN_LENGTH
+
+    Parameters
+    ----------
+    search_term: string
+        the search term inputted
+
+    Returns
+    -------
+    string
+        the FTS5 query, empty if the term has no words
+    '''
+    words = re.findall(r"\w+", canonicalize_query(search_term))
+    if not words:
+        return ""
+    terms = [f'"{word}"' for word in words]
+    if len(words[-1]) >= LOCAL_PREFIX_MIN_LENGTH:
+        terms[-1] += "*"
+    return " ".join(terms)
+
+
+def full_text_loses_characters(search_term):
+    '''Checks whether the full-text index cannot search part of a
+    search term, e.g. the "++" of "c++", which the tokenizer drops.
+    Spacing and punctuation that only separates words do not count
+
+    Parameters
+    ----------
+    search_term: string
+        the search term inputted
+
+    Returns
+    -------
+    bool
+        True if a full-text query would match a different search
+    '''
+    return bool(LOCAL_IGNORED_CHARACTERS.sub("", canonicalize_query(search_term)))
+
+
+def search_local_books(search_term, limit=GOOGLE_BOOKS_MAX_RESULTS):
+    '''Searches the books already in the database with the full-text
+    index, best matches first. Matches in the title weigh most, then
+    the subtitle, the author and the category
+
+    Parameters
+    ----------
+    search_term: string
+        the search term inputted
+    limit: int
+        the most books returned
 
     Returns
     -------
-    none
+    list
+        (VolumeId, Title, Score) tuples of the matching books, Score
+        being the bm25 rank, lower for better matches
     '''
-    i = 1
-    for title in INSPIRED_TITLE_LIST:
-        print(f"{i}. {title}")
-        i += 1
+    query = full_text_query(search_term)
+    if not query:
+        return []
+    return queries.fetchall(
+        get_db_session(), queries.LOCAL_BOOK_SEARCH, (query, limit))
 
 
-def extract_book_from_database(user_input):
-    '''Extracts relevant records from the Books table in database
+def save_local_results(search_term, max_results=GOOGLE_BOOKS_MAX_RESULTS,
+                       min_results=LOCAL_MIN_RESULTS, max_score=LOCAL_MAX_SCORE):
+    '''Answers a search from the full-text index when it finds at
+    least min_results books scoring max_score or better, saving them
+    as the search's results so the charts and author lookups work as
+    after an API search, and marking the search as ingested. Terms the
+    index cannot search in full are left to the API
 
     Parameters
     ----------
-    user_input: string
+    search_term: string
         the search term inputted
-    
+    max_results: int
+        the most books kept
+    min_results: int
+        the least number of local matches that answers the search
+    max_score: float
+        the bm25 score a match must reach; words found in most books
+        score near 0
+
     Returns
     -------
-    list
-        a list of tuples that contains the extracted records
+    bool
+        True if the search was answered locally, False if the API
+        is needed
     '''
-    conn = sqlite3.connect("finalproject.sqlite")
-    cur = conn.cursor()
-    query = f'''
-    SELECT Title, Subtitle, Author, PublishedDate
-    FROM Books
-    WHERE Keyword = '{user_input}'
-    '''     
-    results = cur.execute(query).fetchall()
-    conn.close()
-    return results
+    keyword = canonicalize_query(search_term)
+    if full_text_loses_characters(keyword):
+        return False
+    hits = [hit for hit in search_local_books(keyword, max_results)
+            if hit[2] <= max_score]
+    if len(hits) < min_results:
+        return False
+    rows = [(keyword, volume_id, rank)
+            for rank, (volume_id, _, _) in enumerate(hits)]
+    with get_db_session().transaction() as conn:
+        queries.executemany(conn, queries.DELETE_SEARCH_VOLUMES, [(keyword,)])
+        queries.executemany(conn, queries.UPSERT_SEARCH_VOLUMES, rows)
+        queries.executemany(conn, queries.UPSERT_SEARCH,
+                            [('books', keyword, time.time(), len(hits), False)])
+    return True
 
 
 def display_book_results(results):
@@ -378,7 +2135,10 @@ def display_book_results(results):
     '''
     i = 1
     for book in results:
-        print(f"{i}. {book[0]}- {book[1]}:{book[2]} ({book[3]})", end='\n')
+        subtitle = book[1] or "No subtitle"
+        author = book[2] or "No author"
+        publishedDate = book[3] or "NA"
+        print(f"{i}. {book[0]}- {subtitle}:{author} ({publishedDate})", end='\n')
         i += 1
 
 
@@ -395,16 +2155,9 @@ def extract_wikiresult_from_database(author):
     list
         a list of tuples that contains the extracted records
     '''
-    conn = sqlite3.connect("finalproject.sqlite")
-    cur = conn.cursor()
-    query = f'''
-    SELECT Title, Url
-    FROM WikiResults
-    WHERE SearchTerm = '{author}'
-    '''     
-    results = cur.execute(query).fetchall()
-    conn.close()
-    return results
+    author = canonicalize_author(author)
+    return queries.fetchall(
+        get_db_session(), queries.WIKIRESULTS_BY_SEARCH_TERM, (author,))
 
 
 def display_wiki_results(results):
@@ -445,7 +2198,7 @@ def display_visualize_options():
     print(f"*****")
 
 
-def count_books_category(user_input):
+def count_books_category(user_input, columnar=False):
     '''Extracts categories and counts of relevant records
     from the database
 
@@ -453,52 +2206,158 @@ def count_books_category(user_input):
     ----------
     user_input: string
         the search term inputted
-        to filter relevant records from database
+        to filter relevant records from database,
+        None for every book in the database
+    columnar: bool
+        whether to return columns instead of tuples
 
     Returns
     -------
-    list
-        a list of tuples that contains the extracted records
+    list or dict
+        a list of tuples that contains the extracted records, or
+        with columnar, a dict with the "category" labels and their
+        "count" array, computed from category codes with one bincount
     '''
-    conn = sqlite3.connect("finalproject.sqlite")
-    cur = conn.cursor()
-    query = f'''
-    SELECT Category, COUNT(*)
-    FROM Books
-    WHERE Keyword = '{user_input}'
-    GROUP BY Category
-    '''     
-    results = cur.execute(query).fetchall()
-    conn.close()
-    return results
+    if not columnar:
+        if user_input is None:
+            return queries.fetchall(get_db_session(), queries.CATEGORY_COUNTS_ALL)
+        user_input = canonicalize_query(user_input)
+        return queries.fetchall(
+            get_db_session(), queries.CATEGORY_COUNTS_BY_KEYWORD, (user_input,))
+    if user_input is None:
+        codes_query, labels_query, params = (
+            queries.CATEGORY_CODES_ALL, queries.CATEGORY_LABELS_ALL, ())
+    else:
+        codes_query, labels_query, params = (
+            queries.CATEGORY_CODES_BY_KEYWORD, queries.CATEGORY_LABELS_BY_KEYWORD,
+            (canonicalize_query(user_input),))
+    with get_db_session().snapshot() as session:
+        labels = [row[0] for row in queries.fetchall(session, labels_query, params)]
+        codes, = queries.fetch_columns(session, codes_query, params, ('q',))
+    return {"category": labels, "count": queries.count_codes(codes, len(labels))}
 
 
-def plot_category_barchart(results):
-    '''Presents barplot that groups results by category
+def corpus_report(top=REPORT_TOP):
+    '''Answers questions across every book in the database from the
+    summary tables, without scanning the books themselves
 
     Parameters
     ----------
-    results: list
-        extracted information from the database
+    top: int
+        the number of categories and authors listed
+
+    Returns
+    -------
+    dict
+        "categories": (category, books) for the largest categories,
+        "authors": (author, books, ratings, average rating) for the
+        most-rated authors, "ratings" and "prices": (bucket, books)
+        histograms
+    '''
+    session = get_db_session()
+    return {
+        "categories": queries.fetchall(session, queries.TOP_CATEGORIES, (top,)),
+        "authors": queries.fetchall(session, queries.TOP_AUTHORS, (top,)),
+        "ratings": queries.fetchall(session, queries.RATING_HISTOGRAM),
+        "prices": queries.fetchall(session, queries.PRICE_HISTOGRAM),
+    }
+
+
+def display_corpus_report(report):
+    '''Displays the corpus report in the console
+
+    Parameters
+    ----------
+    report: dict
+        the report returned by corpus_report
 
     Returns
     -------
     none
     '''
-    xvals = []
-    yvals = []
-    
-    for result in results:
-        xvals.append(result[0])
-        yvals.append(result[1])
+    print("Top categories")
+    for category, books in report["categories"]:
+        print(f"  {books:>6}  {category}")
+    print("Most-rated authors")
+    for author, books, ratings, average in report["authors"]:
+        print(f"  {ratings:>8} ratings  {average:4.2f} avg  {books:>4} books  {author}")
+    print("Average rating distribution")
+    for bucket, books in report["ratings"]:
+        print(f"  {bucket:3.1f}-{bucket + 0.5:3.1f}  {books}")
+    print("Price distribution")
+    for bucket, books in report["prices"]:
+        print(f"  {bucket:>6.0f}-{bucket + PRICE_BUCKET:<6.0f}  {books}")
+
+
+def plot_values(column):
+    '''Passes a column to plotly: NumPy arrays as they are, array
+    module arrays as lists, since plotly does not accept those
+
+    Parameters
+    ----------
+    column: array
+        a column returned by the query layer
+
+    Returns
+    -------
+    array or list
+        values plotly accepts
+    '''
+    if isinstance(column, array):
+        return column.tolist()
+    return column
+
+
+def build_category_barchart(results):
+    '''Builds the barplot that groups results by category
+
+    Parameters
+    ----------
+    results: list or dict
+        extracted information from the database, as tuples
+        or as the columns of count_books_category
+
+    Returns
+    -------
+    plotly.graph_objs.Figure
+        the figure
+    '''
+    import plotly.graph_objs as go
+    if isinstance(results, dict):
+        xvals = results["category"]
+        yvals = plot_values(results["count"])
+    else:
+        xvals = []
+        yvals = []
+
+        for result in results:
+            xvals.append(result[0])
+            yvals.append(result[1])
 
     bar_data = go.Bar(x=xvals, y=yvals)
     basic_layout = go.Layout(title="Book Search Results by Category")
-    fig = go.Figure(data=bar_data, layout=basic_layout)
+    return go.Figure(data=bar_data, layout=basic_layout)
+
+
+def plot_category_barchart(results):
+    '''Presents barplot that groups results by category
+
+    Parameters
+    ----------
+    results: list or dict
+        extracted information from the database, as tuples
+        or as the columns of count_books_category
+
+    Returns
+    -------
+    none
+    '''
+    with metrics.span("plot.build_category_barchart"):
+        fig = build_category_barchart(results)
     fig.show()
 
 
-def get_ratings_info(user_input):
+def get_ratings_info(user_input, columnar=False):
     '''Extracts average ratings and rating counts 
     of relevant records from the database
 
@@ -506,88 +2365,373 @@ def get_ratings_info(user_input):
     ----------
     user_input: string
         the search term inputted
-        to filter relevant records from database
+        to filter relevant records from database,
+        None for every book in the database
+    columnar: bool
+        whether to return columns instead of tuples
 
     Returns
     -------
-    list
-        a list of tuples that contains the extracted records
+    list or dict
+        a list of tuples that contains the extracted records, or
+        with columnar, a dict with "average_rating" and "rating_count"
+        float arrays (NaN where missing) and the "title" list
     '''
-    conn = sqlite3.connect("finalproject.sqlite")
-    cur = conn.cursor()
-    query = f'''
-    SELECT AverageRating, RatingCount, Title
-    FROM Books
-    WHERE Keyword = '{user_input}'
-    '''     
-    results = cur.execute(query).fetchall()
-    conn.close()
-    return results
+    if not columnar:
+        if user_input is None:
+            return queries.fetchall(get_db_session(), queries.RATINGS_ALL)
+        user_input = canonicalize_query(user_input)
+        return queries.fetchall(
+            get_db_session(), queries.RATINGS_BY_KEYWORD, (user_input,))
+    if user_input is None:
+        query, params = queries.RATING_COLUMNS_ALL, ()
+    else:
+        query, params = (queries.RATING_COLUMNS_BY_KEYWORD,
+                         (canonicalize_query(user_input),))
+    average_rating, rating_count, title = queries.fetch_columns(
+        get_db_session(), query, params, ('d', 'd', None))
+    return {"average_rating": average_rating, "rating_count": rating_count,
+            "title": title}
 
 
-def plot_rating_scatter(results):
-    '''Presents scatter plot for average ratings and rating counts
+def thin_scatter_points(xvals, yvals, hovertext, max_points=SCATTER_MAX_POINTS):
+    '''Reduces a large scatter to at most max_points markers. Books
+    without both values are dropped, books at the same point become one
+    marker whose hover names the first title and how many others share
+    it, and if that is still too many, markers are decimated evenly
 
     Parameters
     ----------
-    results: list
-        extracted information from the database
+    xvals: list
+        the x values, NaN or None where missing
+    yvals: list
+        the y values, NaN or None where missing
+    hovertext: list
+        the title of every point
+    max_points: int
+        the most markers to keep
 
     Returns
     -------
-    none
+    tuple
+        the x values, y values and hover texts of the kept markers
     '''
-    xvals = []
-    yvals = []
-    hovertext = []
-    
-    for result in results:
-        xvals.append(result[0])
-        yvals.append(result[1])
-        hovertext.append(result[2])
-    
-    scatter_data = go.Scatter(
-        x=xvals, 
-        y=yvals,
-        hovertext = hovertext,
-        mode='markers')
+    points = {}
+    for x, y, text in zip(xvals, yvals, hovertext):
+        if x is None or y is None or x != x or y != y:
+            continue
+        if (x, y) in points:
+            points[(x, y)][1] += 1
+        else:
+            points[(x, y)] = [text, 1]
+    markers = list(points.items())
+    if len(markers) > max_points:
+        step = len(markers) / max_points
+        markers = [markers[int(i * step)] for i in range(max_points)]
+    xvals = [x for (x, y), _ in markers]
+    yvals = [y for (x, y), _ in markers]
+    hovertext = [trim_hovertext(text) + (f" (+{count - 1} more)" if count > 1 else "")
+                 for _, (text, count) in markers]
+    return xvals, yvals, hovertext
+
+
+def trim_hovertext(text, length=HOVER_TITLE_LENGTH):
+    '''Shortens a title to at most length characters for a hover label'''
+    if text is None:
+        return ""
+    if len(text) <= length:
+        return text
+    return text[:length - 1] + "\u2026"
+
+
+def build_rating_scatter(results, max_points=SCATTER_MAX_POINTS):
+    '''Builds the scatter plot for average ratings and rating counts.
+    Above SCATTER_WEBGL_THRESHOLD points it is drawn with WebGL and
+    thinned to at most max_points markers with short hover labels, so
+    tens of thousands of books stay responsive in the browser
+
+    Parameters
+    ----------
+    results: list or dict
+        extracted information from the database, as tuples
+        or as the columns of get_ratings_info
+    max_points: int
+        the most markers drawn in large-data mode
+
+    Returns
+    -------
+    plotly.graph_objs.Figure
+        the figure
+    '''
+    import plotly.graph_objs as go
+    if isinstance(results, dict):
+        xvals = plot_values(results["average_rating"])
+        yvals = plot_values(results["rating_count"])
+        hovertext = results["title"]
+    else:
+        xvals = []
+        yvals = []
+        hovertext = []
+
+        for result in results:
+            xvals.append(result[0])
+            yvals.append(result[1])
+            hovertext.append(result[2])
+
+    if len(hovertext) > SCATTER_WEBGL_THRESHOLD:
+        xvals, yvals, hovertext = thin_scatter_points(
+            xvals, yvals, hovertext, max_points)
+        scatter_data = go.Scattergl(
+            x=xvals,
+            y=yvals,
+            hovertext=hovertext,
+            mode='markers')
+    else:
+        scatter_data = go.Scatter(
+            x=xvals,
+            y=yvals,
+            hovertext = hovertext,
+            mode='markers')
     basic_layout = go.Layout(
         title="Average Rating and Rating Count",
         xaxis_title="Average Rating",
         yaxis_title="Rating Count")
-    fig = go.Figure(data=scatter_data, layout=basic_layout)
+    return go.Figure(data=scatter_data, layout=basic_layout)
+
+
+def plot_rating_scatter(results):
+    '''Presents scatter plot for average ratings and rating counts
+
+    Parameters
+    ----------
+    results: list or dict
+        extracted information from the database, as tuples
+        or as the columns of get_ratings_info
+
+    Returns
+    -------
+    none
+    '''
+    with metrics.span("plot.build_rating_scatter"):
+        fig = build_rating_scatter(results)
     fig.show()
 
 
-def search_for_books(resp):
+FIGURE_BUILDERS = {
+    "categories": build_category_barchart,
+    "ratings": build_rating_scatter,
+}
+
+
+def export_figure(kind, results, filename, export_format):
+    '''Builds one figure and writes it to a file. Runs in the export
+    worker processes, so it only takes picklable query results
+
+    Parameters
+    ----------
+    kind: string
+        a key of FIGURE_BUILDERS
+    results: dict
+        the columns the figure is built from
+    filename: string
+        the file to write
+    export_format: string
+        'html' for a page loading the shared plotly.min.js next to it,
+        'json' for the figure's JSON
+
+    Returns
+    -------
+    string
+        the file written
+    '''
+    fig = FIGURE_BUILDERS[kind](results)
+    if export_format == "json":
+        content = fig.to_json()
+    else:
+        content = fig.to_html(include_plotlyjs='directory', full_html=True)
+    with open(filename, "w", encoding="utf-8") as out_file:
+        out_file.write(content)
+    return filename
+
+
+def export_filename(keyword):
+    '''Turns a search term into a safe file name prefix. A short hash
+    of the term keeps terms that differ only in punctuation, like
+    "c++" and "c#", from sharing a prefix'''
+    slug = re.sub(r"[^\w]+", "-", keyword).strip("-") or "search"
+    digest = hashlib.sha1(keyword.encode("utf-8")).hexdigest()[:8]
+    return f"{slug}-{digest}"
+
+
+def export_figures(keywords, out_dir, export_format="html", workers=None):
+    '''Renders the category and rating figures of many search terms
+    to files without a browser. The database is read in this process
+    and the figures are built and written on a process pool. HTML files
+    share one plotly.min.js written once to out_dir instead of each
+    embedding it
+
+    Parameters
+    ----------
+    keywords: iterable
+        the search terms whose figures are exported
+    out_dir: string
+        the directory the files are written to
+    export_format: string
+        'html' or 'json'
+    workers: int
+        the number of worker processes, one per CPU if None
+
+    Returns
+    -------
+    list
+        the files written
+    '''
+    from concurrent.futures import ProcessPoolExecutor
+    os.makedirs(out_dir, exist_ok=True)
+    if export_format == "html":
+        import plotly.offline
+        with open(os.path.join(out_dir, "plotly.min.js"), "w",
+                  encoding="utf-8") as out_file:
+            out_file.write(plotly.offline.get_plotlyjs())
+    written = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for keyword in dict.fromkeys(map(canonicalize_query, keywords)):
+            prefix = os.path.join(out_dir, export_filename(keyword))
+            jobs = {
+                "categories": count_books_category(keyword, columnar=True),
+                "ratings": get_ratings_info(keyword, columnar=True),
+            }
+            for kind, results in jobs.items():
+                filename = f"{prefix}-{kind}.{export_format}"
+                futures.append(executor.submit(
+                    export_figure, kind, results, filename, export_format))
+        for future in futures:
+            written.append(future.result())
+    seconds = time.perf_counter() - start
+    print(f"Exported {len(written)} figures to {out_dir} in {seconds:.1f}s")
+    return written
+
+
+def search_for_books(resp, max_results=GOOGLE_BOOKS_MAX_RESULTS):
     '''Conducts search through Google Books API,saves the 
     results to database, extracts relevant records from the 
-    database, and displays the results in console
+    database, and displays the results in console. Searches
+    already ingested are answered from the database alone, and with
+    LOCAL_FIRST, so are searches the full-text index finds at least
+    LOCAL_MIN_RESULTS good matches for. The Wikipedia results of the
+    authors found are then prefetched in the background
 
     Parameters
     ----------
     resp: string
         the search term inputted
+    max_results: int
+        the most results to retrieve
 
     Returns
     -------
     list
         a list of tuples that contains the extracted records
     '''
-    book_result = get_google_books(resp)
-    for result in book_result['items']:
-        record = create_book_record(result, resp)
-        insert_record_to_books(record)
+    cancel_wiki_prefetch()
+    keyword = canonicalize_query(resp)
+    with metrics.span("search.ingest"):
+        if not is_search_ingested('books', keyword, CACHE_BOOK_TTL,
+                                  deep_search_size(max_results)):
+            if not (LOCAL_FIRST and save_local_results(keyword, max_results)):
+                save_book_records(keyword, iter_book_pages(keyword, max_results),
+                                  max_results)
     book_results = extract_book_from_database(resp)
     display_book_results(book_results)
+    prefetch_wiki_authors(book_results)
 
     return book_results
 
 
+def fetch_book_records(search_term, max_results=GOOGLE_BOOKS_MAX_RESULTS,
+                       priority=quota.BATCH):
+    '''Obtains the Google Books results for a search term and extracts
+    the records, without touching the database
+
+    Parameters
+    ----------
+    search_term: string
+        the search term inputted
+    max_results: int
+        the most results to retrieve
+    priority: int
+        quota.INTERACTIVE or quota.BATCH
+
+    Returns
+    -------
+    list
+        a list of extracted records
+    '''
+    records = []
+    for page in iter_book_pages(search_term, max_results, prefetch=0,
+                                priority=priority):
+        records.extend(page)
+    return records
+
+
+def save_book_records(search_term, pages, max_results=None):
+    '''Saves the records of a search to the database page by page, as
+    they arrive, replacing its earlier results, and marks the search
+    as ingested
+
+    Parameters
+    ----------
+    search_term: string
+        the search term inputted
+    pages: iterable
+        a list of extracted records per page
+    max_results: int
+        the most results requested; fewer saved means the search
+        has no more
+
+    Returns
+    -------
+    none
+    '''
+    saved = 0
+    for records in pages:
+        insert_records_to_books(records, start_rank=saved, replace=saved == 0)
+        saved += len(records)
+    if saved == 0:
+        with get_db_session().transaction() as conn:
+            queries.executemany(conn, queries.DELETE_SEARCH_VOLUMES, [(search_term,)])
+    exhausted = max_results is not None and saved < max_results
+    mark_search_ingested('books', search_term, saved, exhausted)
+
+
+def deep_search_size(max_results):
+    '''Returns how many results an ingested search must have saved to
+    answer a request for max_results from the database. Requests within
+    the first page accept any ingested search, since most searches have
+    fewer results than that
+
+    Parameters
+    ----------
+    max_results: int
+        the most results requested
+
+    Returns
+    -------
+    int
+        the least number of results saved
+    '''
+    if max_results <= GOOGLE_BOOKS_PAGE_SIZE:
+        return 0
+    return max_results
+
+
 def search_on_wiki(book_results, resp_wiki):
     '''Conducts search through Wikipedia API,saves the results 
     to database, extracts relevant records from the database, 
-    and displays the results in console
+    and displays the results in console. Authors already
+    ingested are answered from the database alone
 
     Parameters
     ----------
@@ -601,17 +2745,241 @@ def search_on_wiki(book_results, resp_wiki):
     none
     '''
     author = book_results[int(resp_wiki)-1][2]
-    wiki_result = get_wiki_results(author)
-    for result in wiki_result['pages'].values():
-        try:
-            record = create_wikiresult_record(result, author)
-            insert_record_to_wikiresults(record)
-        except:
-            pass
+    if author is None:
+        raise ValueError("the book has no author")
+    author = canonicalize_author(author)
+    ingest_wiki_results(author)
     results = extract_wikiresult_from_database(author)
     display_wiki_results(results) 
 
 
+def ingest_wiki_results(author):
+    '''Saves the Wikipedia results for an author to the database,
+    unless they were already ingested
+
+    Parameters
+    ----------
+    author: string
+        the canonical author's name
+
+    Returns
+    -------
+    none
+    '''
+    if not is_search_ingested('wiki', author, CACHE_WIKI_TTL):
+        wiki_result = get_wiki_results(author, allow_stale=False)
+        records = [create_wikiresult_record(result, author)
+                   for result in wiki_result['pages'].values()]
+        records = [record for record in records if record is not None]
+        insert_records_to_wikiresults(records)
+        mark_search_ingested('wiki', author, len(records))
+
+
+def prefetch_wiki_authors(book_results, limit=WIKI_PREFETCH_LIMIT):
+    '''Starts fetching the Wikipedia results of the first limit distinct
+    authors of a search in the background, so picking an author is
+    usually answered from the database. A prefetch still running from
+    the previous search is cancelled first
+
+    Parameters
+    ----------
+    book_results: list
+        extracted results of books information
+    limit: int
+        the most authors prefetched
+
+    Returns
+    -------
+    list
+        the futures of the prefetched authors
+    '''
+    global WIKI_EXECUTOR, WIKI_PREFETCH
+    cancel_wiki_prefetch()
+    if WIKI_EXECUTOR is None:
+        WIKI_EXECUTOR = ThreadPoolExecutor(max_workers=WIKI_PREFETCH_CONCURRENCY)
+    authors = dict.fromkeys(canonicalize_author(book[2])
+                            for book in book_results if book[2] is not None)
+    cancelled = threading.Event()
+    futures = [WIKI_EXECUTOR.submit(prefetch_wiki_author, author, cancelled)
+               for author in list(authors)[:limit]]
+    WIKI_PREFETCH = (cancelled, futures)
+    return futures
+
+
+def prefetch_wiki_author(author, cancelled):
+    '''Prefetches one author unless the prefetch was cancelled. Errors
+    are ignored: the lookup is retried if the user picks the author'''
+    if cancelled.is_set():
+        return
+    try:
+        ingest_wiki_results(author)
+    except Exception:
+        pass
+
+
+def cancel_wiki_prefetch():
+    '''Cancels the background prefetch of the last search. Authors not
+    started yet are skipped, and those being fetched finish
+
+    Parameters
+    ----------
+    none
+
+    Returns
+    -------
+    none
+    '''
+    global WIKI_PREFETCH
+    if WIKI_PREFETCH is not None:
+        cancelled, futures = WIKI_PREFETCH
+        cancelled.set()
+        for future in futures:
+            future.cancel()
+        WIKI_PREFETCH = None
+
+
+def shutdown_wiki_prefetch():
+    '''Cancels the background prefetch and shuts its executor down
+    without waiting, so exiting only waits for the authors being
+    fetched and not for every queued one
+
+    Parameters
+    ----------
+    none
+
+    Returns
+    -------
+    none
+    '''
+    global WIKI_EXECUTOR
+    cancel_wiki_prefetch()
+    if WIKI_EXECUTOR is not None:
+        WIKI_EXECUTOR.shutdown(wait=False, cancel_futures=True)
+        WIKI_EXECUTOR = None
+
+
+def read_terms(filename):
+    '''Yields the search terms in a file, one per line,
+    skipping blank lines
+
+    Parameters
+    ----------
+    filename: string
+        the name of the file, or '-' to read from stdin
+
+    Returns
+    -------
+    generator
+        the search terms
+    '''
+    if filename == '-':
+        lines = sys.stdin
+    else:
+        lines = open(filename, 'r')
+    with lines:
+        for line in lines:
+            if line.strip():
+                yield line.strip()
+
+
+def batch_search(terms, concurrency=BATCH_CONCURRENCY,
+                 max_results=GOOGLE_BOOKS_MAX_RESULTS):
+    '''Searches Google Books for many terms without prompting. Up to
+    concurrency terms are fetched at once on a thread pool, each
+    distinct canonical term is fetched only once,
+    and the calling thread is the only one writing to the database,
+    saving each term's records as soon as they arrive
+
+    Parameters
+    ----------
+    terms: iterable
+        the search terms
+    concurrency: int
+        the most requests in flight at the same time
+    max_results: int
+        the most results to retrieve per term
+
+    Returns
+    -------
+    dict
+        how many terms were fetched, skipped as already ingested,
+        answered from the full-text index or failed, and the number
+        of records saved
+    '''
+    open_caches()
+    summary = {"fetched": 0, "skipped": 0, "local": 0, "failed": 0,
+               "records": 0}
+    seen = set()
+    in_flight = {}
+    start = time.perf_counter()
+
+    def save_done(done):
+        for future in done:
+            term = in_flight.pop(future)
+            try:
+                records = future.result()
+            except Exception as error:
+                summary["failed"] += 1
+                print(f"Failed to search '{term}': {error}")
+                continue
+            save_book_records(term, [records], max_results)
+            summary["fetched"] += 1
+            summary["records"] += len(records)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for term in terms:
+            term = canonicalize_query(term)
+            if term in seen:
+                continue
+            seen.add(term)
+            if is_search_ingested('books', term, CACHE_BOOK_TTL,
+                                  deep_search_size(max_results)):
+                summary["skipped"] += 1
+                continue
+            if LOCAL_FIRST and save_local_results(term, max_results):
+                summary["local"] += 1
+                continue
+            future = executor.submit(fetch_book_records, term, max_results)
+            in_flight[future] = term
+            if len(in_flight) >= 2 * concurrency:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                save_done(done)
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            save_done(done)
+
+    seconds = time.perf_counter() - start
+    print(f"Fetched {summary['fetched']} terms ({summary['records']} records), "
+          f"skipped {summary['skipped']}, answered {summary['local']} locally, "
+          f"failed {summary['failed']} "
+          f"in {seconds:.2f}s")
+    return summary
+
+
+def search_at_prompt(resp):
+    '''Runs search_for_books for the prompt, reporting a spent quota or
+    an unreachable API instead of failing
+
+    Parameters
+    ----------
+    resp: string
+        the search term inputted
+
+    Returns
+    -------
+    list
+        the extracted records, or None if the search failed
+    '''
+    import requests
+    try:
+        return search_for_books(resp)
+    except quota.QuotaExceeded as error:
+        print(f"Google Books is unavailable until tomorrow: {error}")
+    except requests.RequestException as error:
+        print(f"Could not get results from Google Books: {error}")
+    return None
+
+
 def interactive_program():
     '''Allows a user to interactively input commands, present 
     the results in the console, and visualize the results 
@@ -626,27 +2994,33 @@ def interactive_program():
     none
     '''
     #load cache
-    CACHE_BOOK_DICT = load_cache(CACHE_BOOK_FILENAME)
-    CACHE_WIKI_DICT = load_cache(CACHE_WIKI_FILENAME)
+    open_caches()
 
-    #load inspired titles list
-    build_inspired_titles_list()
+    #load inspired titles list in the background
+    start_inspired_titles_loading()
 
-    #Create tables in database
+    #Create or upgrade tables in database
     create_database()
 
     while True:
         resp = input(f"\nEnter a search term, 'inspired' to get inspired by recommended books, or 'exit' to quit:")
         if resp == 'inspired':
-            print_inspired_list()
+            try:
+                titles = inspired_titles()
+            except Exception as error:
+                print(f"Could not load the inspired books list: {error}")
+                continue
+            print_inspired_list(titles)
             resp_title = input(f"\nEnter a corresponding number to search with the title:")
             if int(resp_title) < 1:
                 print(f"Invalid input.")
                 continue
             else:
                 try:
-                    title = INSPIRED_TITLE_LIST[int(resp_title)-1]
-                    book_results = search_for_books(title)
+                    title = titles[int(resp_title)-1]
+                    book_results = search_at_prompt(title)
+                    if book_results is None:
+                        continue
                     while True:
                         resp_plot = input(f"\nDo you want to visualize the results, enter 'yes' or 'no':")
                         if resp_plot == 'yes':
@@ -737,7 +3111,9 @@ def interactive_program():
         elif resp == 'exit':
             break
         else:
-            book_results = search_for_books(resp)
+            book_results = search_at_prompt(resp)
+            if book_results is None:
+                continue
             while True:
                 resp_plot = input(f"\nDo you want to visualize the results, enter 'yes' or 'no':")
                 if resp_plot == 'yes':
@@ -822,7 +3198,118 @@ def interactive_program():
                 break
 
 
+def print_metrics(output_format="report"):
+    '''Prints the collected timings and counters
+
+    Parameters
+    ----------
+    output_format: string
+        'report' for a table, 'json' or 'prometheus' for a dump
+
+    Returns
+    -------
+    none
+    '''
+    if output_format == "json":
+        print(metrics.to_json())
+    elif output_format == "prometheus":
+        print(metrics.to_prometheus(), end="")
+    else:
+        print(metrics.report())
+
+
+def parse_args(argv):
+    '''Parses the command line options
+
+    Parameters
+    ----------
+    argv: list
+        the command line arguments, without the program name
+
+    Returns
+    -------
+    argparse.Namespace
+        the parsed options
+    '''
+    parser = argparse.ArgumentParser(
+        description="Search Google Books and Wikipedia. "
+                    "Runs interactively unless an option below is given.")
+    parser.add_argument(
+        "--batch", metavar="FILE",
+        help="search every term in FILE (one per line, '-' for stdin)")
+    parser.add_argument(
+        "--inspired", action="store_true",
+        help="search every title of the inspired books list")
+    parser.add_argument(
+        "--concurrency", type=int, default=BATCH_CONCURRENCY,
+        help="requests in flight at once in batch mode")
+    parser.add_argument(
+        "--max-results", type=int, default=GOOGLE_BOOKS_MAX_RESULTS,
+        help="the most Google Books results to retrieve per term")
+    parser.add_argument(
+        "--export", metavar="DIR",
+        help="write the figures of the searched terms, or of every "
+             "stored search if no terms are given, to DIR")
+    parser.add_argument(
+        "--export-format", choices=("html", "json"), default="html",
+        help="the format of exported figures")
+    parser.add_argument(
+        "--local-first", action="store_true",
+        help="answer searches from the books already stored when "
+             f"at least {LOCAL_MIN_RESULTS} match well")
+    parser.add_argument(
+        "--profile", nargs="?", const="report",
+        choices=("report", "json", "prometheus"),
+        help="time every stage and print a report at exit, or dump the "
+             "metrics as JSON or in the Prometheus text format")
+    parser.add_argument(
+        "--report", action="store_true",
+        help="print statistics across every book in the database")
+    parser.add_argument(
+        "--backfill", action="store_true",
+        help="ingest every cached Google Books response into the database")
+    return parser.parse_args(argv)
+
+
 # MAIN PROGRAM
 if __name__ == "__main__":
-    interactive_program()
-    
\ No newline at end of file
+    args = parse_args(sys.argv[1:])
+    LOCAL_FIRST = args.local_first
+    if args.profile:
+        metrics.enable()
+        atexit.register(print_metrics, args.profile)
+    if args.backfill:
+        create_database()
+        backfill_books_from_cache()
+    elif args.report:
+        create_database()
+        display_corpus_report(corpus_report())
+    elif args.batch or args.inspired or args.export:
+        create_database()
+        #terms are streamed; only the distinct keywords to export are kept
+        keywords = {}
+
+        def searched(terms):
+            for term in terms:
+                if args.export:
+                    keywords[canonicalize_query(term)] = True
+                yield term
+
+        sources = []
+        if args.batch:
+            sources.append(read_terms(args.batch))
+        if args.inspired:
+            sources.append(build_inspired_titles_list())
+        if sources:
+            batch_search(searched(itertools.chain.from_iterable(sources)),
+                         args.concurrency, args.max_results)
+        if args.export:
+            if not sources:
+                keywords = dict.fromkeys(term for term, in queries.fetchall(
+                    get_db_session(), queries.SEARCHED_TERMS, ('books',)))
+            export_figures(keywords, args.export, args.export_format)
+    else:
+        try:
+            interactive_program()
+        finally:
+            shutdown_wiki_prefetch()
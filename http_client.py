@@ -0,0 +1,195 @@
+'''Shared HTTP client for the Google Books, Wikipedia and Elle requests
+made by final_project.py
+
+One requests.Session is shared by every request, so connections are
+pooled and kept alive instead of paying TCP and TLS setup on every call.
+Requests to the same host are limited to max_per_host at a time, every
+request has a timeout, and failed GETs (connection errors, 429 and 5xx)
+are retried with exponential backoff, honouring Retry-After.
+
+HttpClient is the synchronous flavor. AsyncHttpClient offers the same
+calls as coroutines for asyncio code; it runs them on worker threads
+over the same pooled session.
+
+requests is imported when the first client is created, and asyncio by
+the first asynchronous request, not with this module, to keep the
+program's startup fast.
+'''
+import threading
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+
+TIMEOUT = (3.05, 20) # seconds to connect, seconds to read
+MAX_PER_HOST = 4
+RETRIES = 3
+BACKOFF_FACTOR = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+CLIENT = None
+CLIENT_LOCK = threading.Lock()
+
+
+class HttpClient:
+    '''Synchronous HTTP client with connection pooling, keep-alive,
+    per-host concurrency limits, timeouts and retries
+
+    Parameters
+    ----------
+    max_per_host: int
+        the most requests in flight to one host at the same time
+    timeout: float or tuple
+        seconds to wait, or (connect, read) seconds
+    retries: int
+        the most retries of a failed request
+    backoff_factor: float
+        retries wait backoff_factor * 2 ** (retry - 1) seconds
+    retry_statuses: tuple
+        the response statuses that are retried
+    '''
+    def __init__(self, max_per_host=MAX_PER_HOST, timeout=TIMEOUT,
+                 retries=RETRIES, backoff_factor=BACKOFF_FACTOR,
+                 retry_statuses=RETRY_STATUSES):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.host_limits = {}
+        self.lock = threading.Lock()
+        #urllib3 also retries any 413, 429 or 503 with a Retry-After
+        #header, so keep only those among retry_statuses
+        retry_after_statuses = Retry.RETRY_AFTER_STATUS_CODES & frozenset(retry_statuses)
+        retry_class = type("Retry", (Retry,),
+                           {"RETRY_AFTER_STATUS_CODES": retry_after_statuses})
+        retry = retry_class(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=retry_statuses,
+            allowed_methods=frozenset(["GET"]),
+            respect_retry_after_header=True,
+            raise_on_status=False)
+        adapter = HTTPAdapter(
+            pool_connections=8, pool_maxsize=max_per_host, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def host_limit(self, url):
+        '''Returns the semaphore limiting requests to the url's host'''
+        host = urlsplit(url).netloc
+        with self.lock:
+            if host not in self.host_limits:
+                self.host_limits[host] = threading.BoundedSemaphore(
+                    self.max_per_host)
+            return self.host_limits[host]
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        '''Sends a GET request
+
+        Parameters
+        ----------
+        url: string
+            the URL to request
+        params: dict
+            the query string parameters
+        headers: dict
+            extra request headers
+        timeout: float or tuple
+            overrides the client's timeout
+
+        Returns
+        -------
+        requests.Response
+            the response
+        '''
+        with self.host_limit(url):
+            return self.session.get(url, params=params, headers=headers,
+                                    timeout=timeout or self.timeout)
+
+    def get_json(self, url, params=None, headers=None, timeout=None):
+        '''Sends a GET request and decodes the JSON response, raising
+        requests.HTTPError for an error status
+
+        Parameters
+        ----------
+        url: string
+            the URL to request
+        params: dict
+            the query string parameters
+        headers: dict
+            extra request headers
+        timeout: float or tuple
+            overrides the client's timeout
+
+        Returns
+        -------
+        dict
+            the decoded response
+        '''
+        response = self.get(url, params, headers, timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncHttpClient:
+    '''asyncio flavor of HttpClient. Requests are limited per host with
+    asyncio semaphores and run on worker threads over the pooled
+    session of a synchronous client
+
+    Parameters
+    ----------
+    client: HttpClient
+        the client whose session is used, the shared one if None
+    max_per_host: int
+        the most requests in flight to one host at the same time
+    '''
+    def __init__(self, client=None, max_per_host=MAX_PER_HOST):
+        self.client = client or get_client()
+        self.max_per_host = max_per_host
+        self.host_limits = {}
+
+    @asynccontextmanager
+    async def host_limit(self, url):
+        import asyncio
+        host = urlsplit(url).netloc
+        if host not in self.host_limits:
+            self.host_limits[host] = asyncio.Semaphore(self.max_per_host)
+        async with self.host_limits[host]:
+            yield
+
+    async def get(self, url, params=None, headers=None, timeout=None):
+        '''Coroutine version of HttpClient.get'''
+        import asyncio
+        async with self.host_limit(url):
+            return await asyncio.to_thread(
+                self.client.get, url, params, headers, timeout)
+
+    async def get_json(self, url, params=None, headers=None, timeout=None):
+        '''Coroutine version of HttpClient.get_json'''
+        import asyncio
+        async with self.host_limit(url):
+            return await asyncio.to_thread(
+                self.client.get_json, url, params, headers, timeout)
+
+
+def get_client():
+    '''Returns the shared HttpClient, creating it on first use
+
+    Parameters
+    ----------
+    none
+
+    Returns
+    -------
+    HttpClient
+        the shared client
+    '''
+    global CLIENT
+    with CLIENT_LOCK:
+        if CLIENT is None:
+            CLIENT = HttpClient()
+    return CLIENT
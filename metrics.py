@@ -0,0 +1,239 @@
+'''Timing spans, counters and latency histograms for final_project.py
+
+Stages are timed with span() and events counted with count(). Both do
+nothing until enable() is called, so leaving them in the code costs a
+function call and a check of ENABLED. The collected numbers can be
+printed as a report, or dumped as JSON or in the Prometheus text format.
+
+Names are dotted, e.g. "google_books.request"; the Prometheus dump
+turns them into books_google_books_request_seconds and the like.
+'''
+import json
+import math
+import threading
+import time
+from contextlib import nullcontext
+
+ENABLED = False
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, math.inf)
+PROMETHEUS_PREFIX = "books"
+
+COUNTERS = {}
+HISTOGRAMS = {}
+COLLECTORS = []
+LOCK = threading.Lock()
+NULL_SPAN = nullcontext()
+
+
+class Histogram:
+    '''Latency histogram with fixed buckets, as Prometheus keeps them
+
+    Parameters
+    ----------
+    buckets: tuple
+        the upper bound of every bucket in seconds, the last one inf
+    '''
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        '''Estimates the q quantile as the upper bound of its bucket,
+        or the largest observation for the last bucket'''
+        if not self.count:
+            return 0.0
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= q * self.count:
+                return min(bound, self.max)
+        return self.max
+
+
+class Span:
+    '''Times the block it wraps into the histogram of its name'''
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def enable(enabled=True):
+    '''Turns collection on or off'''
+    global ENABLED
+    ENABLED = enabled
+
+
+def reset():
+    '''Forgets everything collected so far'''
+    with LOCK:
+        COUNTERS.clear()
+        HISTOGRAMS.clear()
+
+
+def span(name):
+    '''Returns a context manager timing its block under name
+
+    Parameters
+    ----------
+    name: string
+        the stage being timed
+
+    Returns
+    -------
+    Span
+        the span, a shared no-op when collection is disabled
+    '''
+    if not ENABLED:
+        return NULL_SPAN
+    return Span(name)
+
+
+def observe(name, seconds):
+    '''Records one duration in the histogram of name'''
+    if not ENABLED:
+        return
+    with LOCK:
+        if name not in HISTOGRAMS:
+            HISTOGRAMS[name] = Histogram()
+        HISTOGRAMS[name].observe(seconds)
+
+
+def count(name, value=1):
+    '''Adds value to the counter of name'''
+    if not ENABLED:
+        return
+    with LOCK:
+        COUNTERS[name] = COUNTERS.get(name, 0) + value
+
+
+def register_collector(collector):
+    '''Registers a function returning more counters, as a dict, every
+    time a snapshot is taken, for numbers that are counted elsewhere'''
+    COLLECTORS.append(collector)
+
+
+def snapshot():
+    '''Returns everything collected
+
+    Parameters
+    ----------
+    none
+
+    Returns
+    -------
+    dict
+        "counters" by name, and "timings" by name with the count,
+        total, mean, p50, p95, p99 and max in seconds and the
+        cumulative count of every bucket
+    '''
+    with LOCK:
+        counters = dict(COUNTERS)
+        timings = {}
+        for name, histogram in HISTOGRAMS.items():
+            cumulative = 0
+            buckets = {}
+            for bound, bucket_count in zip(histogram.buckets, histogram.counts):
+                cumulative += bucket_count
+                buckets["+Inf" if bound == math.inf else repr(bound)] = cumulative
+            timings[name] = {
+                "count": histogram.count,
+                "sum": histogram.sum,
+                "mean": histogram.sum / histogram.count if histogram.count else 0.0,
+                "p50": histogram.quantile(0.5),
+                "p95": histogram.quantile(0.95),
+                "p99": histogram.quantile(0.99),
+                "max": histogram.max,
+                "buckets": buckets,
+            }
+    for collector in COLLECTORS:
+        counters.update(collector())
+    return {"counters": dict(sorted(counters.items())),
+            "timings": dict(sorted(timings.items()))}
+
+
+def report():
+    '''Formats a snapshot as a table for the console
+
+    Parameters
+    ----------
+    none
+
+    Returns
+    -------
+    string
+        the report
+    '''
+    data = snapshot()
+    lines = [f"{'stage':<28}{'count':>8}{'total ms':>11}{'mean ms':>10}"
+             f"{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}"]
+    for name, timing in data["timings"].items():
+        lines.append(
+            f"{name:<28}{timing['count']:>8}{timing['sum'] * 1000:>11.1f}"
+            f"{timing['mean'] * 1000:>10.2f}{timing['p50'] * 1000:>10.2f}"
+            f"{timing['p95'] * 1000:>10.2f}{timing['max'] * 1000:>10.2f}")
+    lines.append("")
+    lines.append(f"{'counter':<28}{'value':>12}")
+    for name, value in data["counters"].items():
+        lines.append(f"{name:<28}{value:>12}")
+    return "\n".join(lines)
+
+
+def to_json():
+    '''Returns a snapshot as JSON'''
+    return json.dumps(snapshot(), indent=2)
+
+
+def prometheus_name(name):
+    return f"{PROMETHEUS_PREFIX}_" + "".join(
+        c if c.isalnum() else "_" for c in name)
+
+
+def to_prometheus():
+    '''Returns a snapshot in the Prometheus text exposition format:
+    counters as _total counters and timings as _seconds histograms
+
+    Parameters
+    ----------
+    none
+
+    Returns
+    -------
+    string
+        the metrics
+    '''
+    data = snapshot()
+    lines = []
+    for name, value in data["counters"].items():
+        metric = prometheus_name(name) + "_total"
+        lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric} {value}")
+    for name, timing in data["timings"].items():
+        metric = prometheus_name(name) + "_seconds"
+        lines.append(f"# TYPE {metric} histogram")
+        for bound, cumulative in timing["buckets"].items():
+            lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f"{metric}_sum {timing['sum']}")
+        lines.append(f"{metric}_count {timing['count']}")
+    return "\n".join(lines) + "\n"
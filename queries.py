@@ -0,0 +1,308 @@
+'''Parameterized SQL used by final_project.py
+
+Every query shape has exactly one SQL text and takes its values as bound
+parameters. sqlite3 keeps compiled statements in a per-connection cache
+keyed by the SQL text, so each shape is compiled once per connection and
+reused for every search term, and quotes in a title or an author's name
+can no longer break a query.
+'''
+from array import array
+
+STATEMENT_CACHE_SIZE = 128
+COLUMN_BATCH_SIZE = 4096
+
+BOOKS_BY_KEYWORD = '''
+    SELECT v.Title, v.Subtitle, v.Author, v.PublishedDate
+    FROM SearchVolumes sv JOIN Volumes v ON v.VolumeId = sv.VolumeId
+    WHERE sv.Keyword = ?
+    ORDER BY sv.Rank
+'''
+
+CATEGORY_COUNTS_BY_KEYWORD = '''
+    SELECT COALESCE(v.Category, 'No category'), COUNT(*)
+    FROM SearchVolumes sv JOIN Volumes v ON v.VolumeId = sv.VolumeId
+    WHERE sv.Keyword = ?
+    GROUP BY v.Category
+'''
+
+CATEGORY_COUNTS_ALL = '''
+    SELECT COALESCE(Category, 'No category'), COUNT(*)
+    FROM Volumes
+    GROUP BY Category
+'''
+
+RATINGS_BY_KEYWORD = '''
+    SELECT v.AverageRating, v.RatingCount, v.Title
+    FROM SearchVolumes sv JOIN Volumes v ON v.VolumeId = sv.VolumeId
+    WHERE sv.Keyword = ?
+    ORDER BY sv.Rank
+'''
+
+RATING_COLUMNS_BY_KEYWORD = RATINGS_BY_KEYWORD
+
+RATINGS_ALL = '''
+    SELECT AverageRating, RatingCount, Title
+    FROM Volumes
+'''
+
+RATING_COLUMNS_ALL = RATINGS_ALL
+
+CATEGORY_CODES_BY_KEYWORD = '''
+    SELECT DENSE_RANK() OVER (ORDER BY COALESCE(v.Category, 'No category')) - 1
+    FROM SearchVolumes sv JOIN Volumes v ON v.VolumeId = sv.VolumeId
+    WHERE sv.Keyword = ?
+'''
+
+CATEGORY_LABELS_BY_KEYWORD = '''
+    SELECT DISTINCT COALESCE(v.Category, 'No category') AS Label
+    FROM SearchVolumes sv JOIN Volumes v ON v.VolumeId = sv.VolumeId
+    WHERE sv.Keyword = ?
+    ORDER BY Label
+'''
+
+CATEGORY_CODES_ALL = '''
+    SELECT DENSE_RANK() OVER (ORDER BY COALESCE(Category, 'No category')) - 1
+    FROM Volumes
+'''
+
+CATEGORY_LABELS_ALL = '''
+    SELECT DISTINCT COALESCE(Category, 'No category') AS Label
+    FROM Volumes
+    ORDER BY Label
+'''
+
+TOP_CATEGORIES = '''
+    SELECT Category, Books
+    FROM CategoryStats
+    WHERE Books > 0
+    ORDER BY Books DESC
+    LIMIT ?
+'''
+
+TOP_AUTHORS = '''
+    SELECT Author, Books, Ratings, RatingSum / Ratings
+    FROM AuthorStats
+    WHERE Ratings > 0
+    ORDER BY Ratings DESC
+    LIMIT ?
+'''
+
+RATING_HISTOGRAM = '''
+    SELECT Bucket, Books
+    FROM RatingHistogram
+    WHERE Books > 0
+    ORDER BY Bucket
+'''
+
+PRICE_HISTOGRAM = '''
+    SELECT Bucket, Books
+    FROM PriceHistogram
+    WHERE Books > 0
+    ORDER BY Bucket
+'''
+
+WIKIRESULTS_BY_SEARCH_TERM = '''
+    SELECT Title, Url
+    FROM WikiResults
+    WHERE SearchTerm = ?
+'''
+
+SEARCH_STATUS = '''
+    SELECT FetchedAt, ResultCount, Exhausted
+    FROM Searches
+    WHERE Source = ? AND Term = ?
+'''
+
+LOCAL_BOOK_SEARCH = '''
+    SELECT v.VolumeId, v.Title, bm25(VolumesSearch, 10.0, 4.0, 2.0, 1.0) AS Score
+    FROM VolumesSearch JOIN Volumes v ON v.rowid = VolumesSearch.rowid
+    WHERE VolumesSearch MATCH ?
+    ORDER BY Score
+    LIMIT ?
+'''
+
+SEARCHED_TERMS = '''
+    SELECT Term
+    FROM Searches
+    WHERE Source = ?
+    ORDER BY Term
+'''
+
+UPSERT_VOLUMES = '''
+    INSERT INTO Volumes (Title, Subtitle, Author, PublishedDate, Category,
+                         Price, AverageRating, RatingCount, VolumeId)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (VolumeId) DO UPDATE SET
+        Title = excluded.Title,
+        Subtitle = excluded.Subtitle,
+        Author = excluded.Author,
+        PublishedDate = excluded.PublishedDate,
+        Category = excluded.Category,
+        Price = excluded.Price,
+        AverageRating = excluded.AverageRating,
+        RatingCount = excluded.RatingCount
+'''
+
+UPSERT_SEARCH_VOLUMES = '''
+    INSERT INTO SearchVolumes (Keyword, VolumeId, Rank)
+    VALUES (?, ?, ?)
+    ON CONFLICT (Keyword, VolumeId) DO UPDATE SET
+        Rank = excluded.Rank
+'''
+
+DELETE_SEARCH_VOLUMES = '''
+    DELETE FROM SearchVolumes
+    WHERE Keyword = ?
+'''
+
+UPSERT_WIKIRESULTS = '''
+    INSERT INTO WikiResults (Title, Url, SearchTerm)
+    VALUES (?, ?, ?)
+    ON CONFLICT (SearchTerm, Title) DO UPDATE SET
+        Url = excluded.Url
+'''
+
+UPSERT_SEARCH = '''
+    INSERT INTO Searches (Source, Term, FetchedAt, ResultCount, Exhausted)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (Source, Term) DO UPDATE SET
+        FetchedAt = excluded.FetchedAt,
+        ResultCount = excluded.ResultCount,
+        Exhausted = excluded.Exhausted
+'''
+
+
+NUMPY = None
+
+
+def load_numpy():
+    '''Imports NumPy the first time columns are requested, so startup
+    does not pay for it
+
+    Parameters
+    ----------
+    none
+
+    Returns
+    -------
+    module
+        numpy, or False when it is not installed
+    '''
+    global NUMPY
+    if NUMPY is None:
+        try:
+            import numpy
+            NUMPY = numpy
+        except ImportError:
+            NUMPY = False
+    return NUMPY
+
+
+def fetchall(session, query, params=()):
+    '''Runs one of the read queries above with bound parameters
+
+    Parameters
+    ----------
+    session: DatabaseSession
+        the session to run the query on
+    query: string
+        one of the query constants in this module
+    params: tuple
+        the values bound to the query's placeholders
+
+    Returns
+    -------
+    list
+        a list of tuples that contains the extracted records
+    '''
+    return session.fetchall(query, params)
+
+
+def fetch_columns(session, query, params, typecodes):
+    '''Runs one of the read queries above and returns its result as
+    columns instead of a list of row tuples. Rows are read in batches
+    straight into typed arrays: 'd' columns hold floats with NaN for
+    NULL, 'q' columns hold integers, and None columns stay Python lists.
+    Typed columns are NumPy arrays when NumPy is installed
+
+    Parameters
+    ----------
+    session: DatabaseSession
+        the session to run the query on
+    query: string
+        one of the query constants in this module
+    params: tuple
+        the values bound to the query's placeholders
+    typecodes: tuple
+        the array typecode of each selected column, or None
+
+    Returns
+    -------
+    list
+        one column per selected column
+    '''
+    columns = [array(code) if code else [] for code in typecodes]
+    nan = float('nan')
+    with session.connection() as conn:
+        cursor = conn.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(COLUMN_BATCH_SIZE)
+            if not rows:
+                break
+            for column, code, values in zip(columns, typecodes, zip(*rows)):
+                if code == 'd':
+                    column.extend([nan if value is None else value
+                                   for value in values])
+                else:
+                    column.extend(values)
+    numpy = load_numpy()
+    if numpy:
+        columns = [numpy.frombuffer(column, dtype=column.typecode)
+                   if isinstance(column, array) else column
+                   for column in columns]
+    return columns
+
+
+def count_codes(codes, size):
+    '''Counts how often each integer code in range(size) occurs
+
+    Parameters
+    ----------
+    codes: array
+        a column of integer codes
+    size: int
+        the number of distinct codes
+
+    Returns
+    -------
+    array
+        the count of each code
+    '''
+    numpy = load_numpy()
+    if numpy:
+        return numpy.bincount(codes, minlength=size)
+    counts = array('q', bytes(8 * size))
+    for code in codes:
+        counts[code] += 1
+    return counts
+
+
+def executemany(conn, query, rows):
+    '''Runs one of the write queries above for every row, inside the
+    caller's transaction
+
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        a connection borrowed with DatabaseSession.transaction()
+    query: string
+        one of the query constants in this module
+    rows: list
+        the values bound to the query's placeholders, one tuple per row
+
+    Returns
+    -------
+    int
+        the number of changed rows
+    '''
+    return conn.executemany(query, rows).rowcount
@@ -0,0 +1,227 @@
+'''Request scheduler keeping final_project.py within the Google Books
+API quota
+
+Requests take a token from a bucket refilled at a steady rate per
+second, and from a budget of requests per day. Waiting requests are
+served by priority, so a search typed at the prompt goes ahead of
+queued batch work. A 429 answer pauses every request for its
+Retry-After, and the day's usage and any pause are saved to a file so
+a restart does not forget them.
+
+The clock is a parameter: FakeClock runs the scheduler in tests
+without sleeping.
+'''
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+
+INTERACTIVE = 0
+BATCH = 1
+
+DEFAULT_RETRY_AFTER = 30
+
+
+class QuotaExceeded(Exception):
+    '''Raised when the day's request budget is spent'''
+
+
+class Clock:
+    '''The real clock: wall time in seconds and waiting on a condition'''
+    def time(self):
+        return time.time()
+
+    def wait(self, condition, timeout):
+        condition.wait(timeout)
+
+
+class FakeClock:
+    '''A clock for tests. Time only moves when a request waits for a
+    token or a pause, or when advance is called
+
+    Parameters
+    ----------
+    start: float
+        the initial time, in seconds since the epoch
+    '''
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def time(self):
+        return self.now
+
+    def wait(self, condition, timeout):
+        if timeout is None:
+            condition.wait()
+        else:
+            self.now += timeout
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class QuotaScheduler:
+    '''Token bucket with a per-day budget and priority classes
+
+    Parameters
+    ----------
+    per_second: float
+        the tokens added to the bucket every second
+    burst: int
+        the most tokens the bucket holds
+    per_day: int
+        the most requests per UTC day, None for no limit
+    state_filename: string
+        the file the day's usage and pauses are saved in, None to not
+        save them
+    clock: Clock
+        the clock, a FakeClock in tests
+    '''
+    def __init__(self, per_second, burst=1, per_day=None,
+                 state_filename=None, clock=None):
+        self.per_second = per_second
+        self.burst = burst
+        self.per_day = per_day
+        self.state_filename = state_filename
+        self.clock = clock or Clock()
+        self.tokens = burst
+        self.refilled_at = self.clock.time()
+        self.day = self.today()
+        self.used_today = 0
+        self.paused_until = 0.0
+        self.waiting = []
+        self.tickets = itertools.count()
+        self.condition = threading.Condition()
+        self.load_state()
+
+    def today(self):
+        return time.strftime("%Y-%m-%d", time.gmtime(self.clock.time()))
+
+    def load_state(self):
+        '''Restores the day's usage and any pause saved by an earlier run'''
+        if not self.state_filename:
+            return
+        try:
+            with open(self.state_filename, encoding="utf-8") as state_file:
+                state = json.load(state_file)
+        except (OSError, ValueError):
+            return
+        if state.get("day") == self.day:
+            self.used_today = state.get("used", 0)
+        self.paused_until = state.get("paused_until", 0.0)
+
+    def save_state(self):
+        '''Saves the day's usage and any pause, replacing the file
+        atomically'''
+        if not self.state_filename:
+            return
+        state = {"day": self.day, "used": self.used_today,
+                 "paused_until": self.paused_until}
+        with open(self.state_filename + ".tmp", "w", encoding="utf-8") as state_file:
+            json.dump(state, state_file)
+        os.replace(self.state_filename + ".tmp", self.state_filename)
+
+    def refill(self, now):
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.refilled_at) * self.per_second)
+        self.refilled_at = now
+        if self.today() != self.day:
+            self.day = self.today()
+            self.used_today = 0
+
+    def acquire(self, priority=BATCH):
+        '''Waits until a request may be sent, serving higher priorities
+        (lower numbers) first and requests of the same priority in order
+
+        Parameters
+        ----------
+        priority: int
+            INTERACTIVE or BATCH
+
+        Returns
+        -------
+        none
+        '''
+        with self.condition:
+            ticket = (priority, next(self.tickets))
+            heapq.heappush(self.waiting, ticket)
+            try:
+                while True:
+                    now = self.clock.time()
+                    self.refill(now)
+                    if self.per_day is not None and self.used_today >= self.per_day:
+                        raise QuotaExceeded(
+                            f"the daily budget of {self.per_day} requests is spent")
+                    if self.waiting[0] != ticket:
+                        timeout = None
+                    elif now < self.paused_until:
+                        timeout = self.paused_until - now
+                    elif self.tokens < 1:
+                        timeout = (1 - self.tokens) / self.per_second
+                    else:
+                        self.tokens -= 1
+                        self.used_today += 1
+                        self.save_state()
+                        return
+                    self.clock.wait(self.condition, timeout)
+            finally:
+                self.waiting.remove(ticket)
+                heapq.heapify(self.waiting)
+                self.condition.notify_all()
+
+    def retry_after(self, seconds=DEFAULT_RETRY_AFTER):
+        '''Pauses every request for seconds, after a 429 answer'''
+        with self.condition:
+            self.paused_until = max(self.paused_until,
+                                    self.clock.time() + seconds)
+            self.save_state()
+            self.condition.notify_all()
+
+    def exhaust(self):
+        '''Marks the day's budget as spent, after the API reports it'''
+        with self.condition:
+            self.used_today = max(self.used_today, self.per_day or 0)
+            if self.per_day is None:
+                self.paused_until = self.clock.time() + DEFAULT_RETRY_AFTER
+            self.save_state()
+            self.condition.notify_all()
+
+    def remaining_today(self):
+        '''Returns the requests left in the day's budget, None if unlimited'''
+        with self.condition:
+            self.refill(self.clock.time())
+            if self.per_day is None:
+                return None
+            return max(self.per_day - self.used_today, 0)
+
+
+def parse_retry_after(value, clock=None):
+    '''Converts a Retry-After header to seconds
+
+    Parameters
+    ----------
+    value: string
+        seconds, or an HTTP date
+    clock: Clock
+        the clock dates are compared with
+
+    Returns
+    -------
+    float
+        the seconds to wait, DEFAULT_RETRY_AFTER if the header is
+        missing or unreadable
+    '''
+    if not value:
+        return DEFAULT_RETRY_AFTER
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    from email.utils import parsedate_to_datetime
+    try:
+        retry_at = parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+    return max(retry_at - (clock or Clock()).time(), 0.0)
@@ -0,0 +1,73 @@
+'''Shared fixtures: a local HTTP stub server the tests point the
+clients at instead of the real APIs, and a project whose database and
+caches live in a temporary directory'''
+import http.server
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    '''Answers every GET with the next response of the server's script,
+    repeating the last one, and records what it received'''
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, dict(self.headers),
+                                    self.client_address))
+            server.in_flight += 1
+            server.most_in_flight = max(server.most_in_flight, server.in_flight)
+            index = min(len(server.requests) - 1, len(server.script) - 1)
+            status, headers, body = server.script[index]
+        try:
+            if server.delay:
+                server.delay_event.wait(server.delay)
+            data = body.encode("utf-8")
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    '''Starts a stub server. Set server.script to a list of
+    (status, headers, body) answers and server.delay to slow them down;
+    server.url is its base URL'''
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = []
+    server.script = [(200, {"Content-Type": "application/json"}, "{}")]
+    server.delay = 0
+    server.delay_event = threading.Event()
+    server.in_flight = 0
+    server.most_in_flight = 0
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def project():
+    '''Points final_project's database, caches and quota state at a
+    temporary directory, yielded'''
+    import benchmarks
+    with benchmarks.isolated_project() as tmp:
+        yield tmp
@@ -0,0 +1,22 @@
+import pytest
+
+import final_project
+
+
+@pytest.mark.parametrize("name, canonical", [
+    ("Tolkien, J.R.R.", "j. r. r. tolkien"),
+    ("J. R. R. Tolkien", "j. r. r. tolkien"),
+    ("Le Guin, Ursula K.", "ursula k. le guin"),
+    ("Kurt Vonnegut, Jr.", "kurt vonnegut, jr."),
+    ("Martin Luther King, Jr", "martin luther king, jr"),
+    ("Smith, PhD", "smith, phd"),
+    ("Jane Smith, Ph.D.", "jane smith, ph. d."),
+    ("Henry Ford, II", "henry ford, ii"),
+    ("Vonnegut, Kurt, Jr.", "vonnegut, kurt, jr."),
+])
+def test_canonicalize_author(name, canonical):
+    assert final_project.canonicalize_author(name) == canonical
+
+
+def test_canonicalize_query_folds_spelling():
+    assert final_project.canonicalize_query("  Ender’s   GAME ") == "ender's game"
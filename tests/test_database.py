@@ -0,0 +1,99 @@
+import json
+import os
+import random
+
+import benchmarks
+import final_project
+
+
+def book_page(start, count, total):
+    rng = random.Random(start)
+    return {"totalItems": total,
+            "items": [benchmarks.synthetic_volume(rng, i)
+                      for i in range(start, start + count)]}
+
+
+def search_ranks(keyword=None):
+    rows = final_project.get_db_session().fetchall(
+        "SELECT Keyword, VolumeId, Rank FROM SearchVolumes ORDER BY Keyword, Rank")
+    return [row for row in rows if keyword is None or row[0] == keyword]
+
+
+def test_backfill_ranks_every_page_of_a_search(project):
+    store = final_project.open_cache_store(final_project.CACHE_BOOK_FILENAME)
+    store.put_many([("dune", book_page(0, 25, 60)),
+                    ("dune|start=25", book_page(25, 25, 60)),
+                    ("dune|start=50", book_page(50, 10, 60)),
+                    ("Ender’s  Game", book_page(100, 3, 3))])
+    final_project.backfill_books_from_cache(batch_size=10)
+
+    rows = search_ranks()
+    assert {row[0] for row in rows} == {"dune", "ender's game"}
+    assert [(volume_id, rank) for _, volume_id, rank in search_ranks("dune")] == [
+        (f"vol{i}", i) for i in range(60)]
+    assert final_project.is_search_ingested(
+        'books', "dune", final_project.CACHE_BOOK_TTL, 60)
+    assert final_project.is_search_ingested(
+        'books', "dune", final_project.CACHE_BOOK_TTL, 100)
+    assert final_project.is_search_ingested(
+        'books', "ender's game", final_project.CACHE_BOOK_TTL)
+
+
+def test_cache_entries_move_to_canonical_keys(project):
+    with open(final_project.CACHE_WIKI_FILENAME, "w") as cache_file:
+        json.dump({"Tolkien, J.R.R.": {"query": {}}}, cache_file)
+    store_filename = os.path.splitext(final_project.CACHE_BOOK_FILENAME)[0] + ".sqlite"
+    old_store = final_project.SqliteCacheStore(store_filename)
+    old_store.put_many([("ender’s game", {"old": True}),
+                        ("ender's game", {"old": False}),
+                        ("ender’s  game|start=25", {"page": 2}),
+                        ("dune", {"page": 1})])
+    old_store.close()
+
+    books = final_project.open_cache_store(final_project.CACHE_BOOK_FILENAME)
+    wiki = final_project.open_cache_store(final_project.CACHE_WIKI_FILENAME)
+    assert dict(books.items()) == {"dune": {"page": 1},
+                                   "ender's game": {"old": False},
+                                   "ender's game|start=25": {"page": 2}}
+    assert dict(wiki.items()) == {"j. r. r. tolkien": {"query": {}}}
+    assert books.key_version() == final_project.CACHE_KEY_VERSION
+
+
+def store_titles(titles):
+    volumes = [{"id": f"vol{i}", "volumeInfo": {"title": title}}
+               for i, title in enumerate(titles)]
+    final_project.insert_records_to_books(
+        [final_project.create_book_record(volume, "setup") for volume in volumes])
+
+
+def test_local_first_answers_well_matched_searches(project):
+    store_titles([f"Dune Part {i}" for i in range(12)]
+                 + [f"Cooking Book {i}" for i in range(100)])
+    assert final_project.save_local_results("Dune")
+    assert len(search_ranks("dune")) == 12
+    assert final_project.is_search_ingested('books', "dune")
+
+
+def test_local_first_leaves_poor_matches_to_the_api(project):
+    store_titles([f"Cooking Book {i}" for i in range(20)]
+                 + [f"Crime Story {i}" for i in range(20)]
+                 + [f"Book of Stories {i}" for i in range(60)])
+    for term in ("c++", "c#", "c", "book"):
+        assert not final_project.save_local_results(term), term
+        assert not final_project.is_search_ingested('books', term)
+    assert final_project.full_text_query("c") == '"c"'
+    assert final_project.full_text_query("ender's ga") == '"ender" "s" "ga"'
+    assert final_project.full_text_query("ender's gam") == '"ender" "s" "gam"*'
+
+
+def test_every_book_with_and_without_columns(project):
+    store_titles(["Dune", "Emma", "Ulysses"])
+    categories = final_project.count_books_category(None)
+    assert categories == [("No category", 3)]
+    columns = final_project.count_books_category(None, columnar=True)
+    assert columns["category"] == ["No category"]
+    assert list(columns["count"]) == [3]
+    ratings = final_project.get_ratings_info(None)
+    assert sorted(title for _, _, title in ratings) == ["Dune", "Emma", "Ulysses"]
+    assert sorted(final_project.get_ratings_info(None, columnar=True)["title"]) == [
+        "Dune", "Emma", "Ulysses"]
@@ -0,0 +1,84 @@
+import asyncio
+import threading
+
+import pytest
+import requests
+
+import http_client
+
+
+def test_get_json_decodes_the_response(stub_server):
+    stub_server.script = [(200, {"Content-Type": "application/json"}, '{"a": 1}')]
+    client = http_client.HttpClient()
+    assert client.get_json(stub_server.url + "/books", {"q": "dune"}) == {"a": 1}
+    assert stub_server.requests[0][0] == "/books?q=dune"
+
+
+def test_retries_server_errors(stub_server):
+    stub_server.script = [(503, {}, ""), (502, {}, ""), (200, {}, "{}")]
+    client = http_client.HttpClient(backoff_factor=0)
+    assert client.get(stub_server.url).status_code == 200
+    assert len(stub_server.requests) == 3
+
+
+def test_gives_up_after_the_retries(stub_server):
+    stub_server.script = [(503, {}, "")]
+    client = http_client.HttpClient(retries=2, backoff_factor=0)
+    assert client.get(stub_server.url).status_code == 503
+    assert len(stub_server.requests) == 3
+
+
+def test_keeps_connections_alive(stub_server):
+    client = http_client.HttpClient()
+    for _ in range(5):
+        client.get(stub_server.url)
+    client_ports = {address for _, _, address in stub_server.requests}
+    assert len(stub_server.requests) == 5
+    assert len(client_ports) == 1
+
+
+def test_limits_requests_per_host(stub_server):
+    stub_server.delay = 0.2
+    client = http_client.HttpClient(max_per_host=2)
+    threads = [threading.Thread(target=client.get, args=(stub_server.url,))
+               for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(stub_server.requests) == 6
+    assert stub_server.most_in_flight == 2
+
+
+def test_async_get_and_get_json(stub_server):
+    stub_server.script = [(200, {"Content-Type": "application/json"}, '{"a": 1}')]
+    client = http_client.AsyncHttpClient(http_client.HttpClient())
+
+    async def main():
+        response = await client.get(stub_server.url + "/books", {"q": "dune"})
+        data = await client.get_json(stub_server.url + "/books", {"q": "dune"})
+        return response.status_code, data
+
+    assert asyncio.run(main()) == (200, {"a": 1})
+    assert [path for path, _, _ in stub_server.requests] == ["/books?q=dune"] * 2
+
+
+def test_async_get_json_raises_for_errors(stub_server):
+    stub_server.script = [(404, {}, "")]
+    client = http_client.AsyncHttpClient(http_client.HttpClient())
+    with pytest.raises(requests.HTTPError):
+        asyncio.run(client.get_json(stub_server.url))
+
+
+def test_async_limits_requests_per_host(stub_server):
+    stub_server.delay = 0.2
+    client = http_client.AsyncHttpClient(
+        http_client.HttpClient(max_per_host=10), max_per_host=2)
+
+    async def main():
+        return await asyncio.gather(
+            *(client.get(stub_server.url) for _ in range(6)))
+
+    responses = asyncio.run(main())
+    assert [response.status_code for response in responses] == [200] * 6
+    assert stub_server.most_in_flight == 2
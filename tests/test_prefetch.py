@@ -0,0 +1,17 @@
+import time
+
+import final_project
+
+
+def test_shutdown_skips_queued_authors(project, stub_server, monkeypatch):
+    monkeypatch.setattr(final_project, "WIKIPEDIA_URL", stub_server.url + "/w/api.php")
+    stub_server.delay = 0.5
+    book_results = [("Title", None, f"Author {i}") for i in range(8)]
+    final_project.prefetch_wiki_authors(book_results)
+    executor = final_project.WIKI_EXECUTOR
+    start = time.perf_counter()
+    final_project.shutdown_wiki_prefetch()
+    executor.shutdown(wait=True)
+    assert time.perf_counter() - start < 0.9
+    assert final_project.WIKI_EXECUTOR is None
+    assert len(stub_server.requests) <= final_project.WIKI_PREFETCH_CONCURRENCY
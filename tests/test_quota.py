@@ -0,0 +1,166 @@
+import threading
+import time
+
+import pytest
+import requests
+
+import final_project
+import quota
+
+JSON = {"Content-Type": "application/json"}
+DAY = 24 * 60 * 60
+
+
+class SteppedClock(quota.FakeClock):
+    '''A FakeClock whose time only moves when the test advances it, so
+    waiting requests stay queued until then'''
+    def wait(self, condition, timeout):
+        condition.wait(0.01)
+
+
+def wait_for(predicate):
+    deadline = time.monotonic() + 5
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_interactive_requests_go_before_queued_batch_requests():
+    clock = SteppedClock()
+    scheduler = quota.QuotaScheduler(1, clock=clock)
+    scheduler.acquire()
+    served = []
+
+    def request(priority):
+        scheduler.acquire(priority)
+        served.append(priority)
+
+    batch = threading.Thread(target=request, args=(quota.BATCH,))
+    batch.start()
+    wait_for(lambda: len(scheduler.waiting) == 1)
+    interactive = threading.Thread(target=request, args=(quota.INTERACTIVE,))
+    interactive.start()
+    wait_for(lambda: len(scheduler.waiting) == 2)
+    clock.advance(1)
+    wait_for(lambda: len(served) == 1)
+    clock.advance(1)
+    batch.join(5)
+    interactive.join(5)
+    assert served == [quota.INTERACTIVE, quota.BATCH]
+
+
+def test_bucket_paces_requests():
+    clock = quota.FakeClock()
+    scheduler = quota.QuotaScheduler(2, burst=3, clock=clock)
+    for _ in range(3):
+        scheduler.acquire()
+    assert clock.time() == 0
+    scheduler.acquire()
+    assert clock.time() == pytest.approx(0.5)
+
+
+def test_retry_after_pauses_every_request():
+    clock = quota.FakeClock()
+    scheduler = quota.QuotaScheduler(100, burst=10, clock=clock)
+    scheduler.retry_after(30)
+    scheduler.acquire()
+    assert clock.time() == pytest.approx(30)
+
+
+def test_daily_budget_rolls_over_at_midnight():
+    clock = quota.FakeClock(DAY - 10)
+    scheduler = quota.QuotaScheduler(100, burst=10, per_day=2, clock=clock)
+    scheduler.acquire()
+    scheduler.acquire()
+    with pytest.raises(quota.QuotaExceeded):
+        scheduler.acquire()
+    clock.advance(10)
+    scheduler.acquire()
+    assert scheduler.used_today == 1
+    assert scheduler.remaining_today() == 1
+
+
+def test_state_survives_a_restart(tmp_path):
+    filename = str(tmp_path / "quota.json")
+    clock = quota.FakeClock()
+    scheduler = quota.QuotaScheduler(100, burst=10, per_day=5,
+                                     state_filename=filename, clock=clock)
+    scheduler.acquire()
+    scheduler.acquire()
+    scheduler.retry_after(60)
+    restarted = quota.QuotaScheduler(100, burst=10, per_day=5,
+                                     state_filename=filename, clock=clock)
+    assert restarted.used_today == 2
+    assert restarted.paused_until == 60
+    clock.advance(DAY)
+    tomorrow = quota.QuotaScheduler(100, burst=10, per_day=5,
+                                    state_filename=filename, clock=clock)
+    assert tomorrow.used_today == 0
+
+
+def test_parse_retry_after():
+    clock = quota.FakeClock(784111777)
+    assert quota.parse_retry_after("120") == 120
+    assert quota.parse_retry_after("Sun, 06 Nov 1994 08:49:37 GMT", clock) == 0
+    assert quota.parse_retry_after("Sun, 06 Nov 1994 08:50:37 GMT", clock) == 60
+    assert quota.parse_retry_after(None) == quota.DEFAULT_RETRY_AFTER
+    assert quota.parse_retry_after("soon") == quota.DEFAULT_RETRY_AFTER
+
+
+@pytest.fixture
+def google_books(stub_server, monkeypatch):
+    '''Points fetch_google_books at the stub server, with a scheduler on
+    a FakeClock'''
+    clock = quota.FakeClock()
+    scheduler = quota.QuotaScheduler(100, burst=10, per_day=100, clock=clock)
+    monkeypatch.setattr(final_project, "GOOGLE_BOOKS_URL",
+                        stub_server.url + "/books/v1/volumes")
+    monkeypatch.setattr(final_project, "GOOGLE_BOOKS_QUOTA", scheduler)
+    monkeypatch.setattr(final_project, "GOOGLE_BOOKS_CLIENT", None)
+    monkeypatch.setattr(final_project.secrets, "GOOGLE_API_KEY", "test",
+                        raising=False)
+    return scheduler
+
+
+def test_429_is_retried_through_the_scheduler(stub_server, google_books):
+    stub_server.script = [(429, {"Retry-After": "5"}, ""),
+                          (200, JSON, '{"totalItems": 0}')]
+    assert final_project.fetch_google_books("dune") == {"totalItems": 0}
+    assert len(stub_server.requests) == 2
+    assert google_books.used_today == len(stub_server.requests)
+    assert google_books.clock.time() == pytest.approx(5)
+
+
+def test_429_takes_one_slot_per_request_sent(stub_server, google_books):
+    stub_server.script = [(429, {"Retry-After": "1"}, "")]
+    with pytest.raises(requests.HTTPError):
+        final_project.fetch_google_books("dune")
+    assert len(stub_server.requests) == final_project.GOOGLE_BOOKS_ATTEMPTS
+    assert google_books.used_today == len(stub_server.requests)
+
+
+def test_spent_daily_limit_stops_requests(stub_server, google_books):
+    stub_server.script = [(403, JSON, '{"error": {"errors": '
+                                      '[{"reason": "dailyLimitExceeded"}]}}')]
+    with pytest.raises(requests.HTTPError):
+        final_project.fetch_google_books("dune")
+    assert google_books.remaining_today() == 0
+    with pytest.raises(quota.QuotaExceeded):
+        final_project.fetch_google_books("dune")
+    assert len(stub_server.requests) == 1
+
+
+def test_server_errors_are_retried_through_the_scheduler(stub_server, google_books):
+    stub_server.script = [(503, {}, ""), (500, {}, ""),
+                          (200, JSON, '{"totalItems": 0}')]
+    assert final_project.fetch_google_books("dune") == {"totalItems": 0}
+    assert len(stub_server.requests) == 3
+    assert google_books.used_today == len(stub_server.requests)
+
+
+def test_server_errors_take_one_slot_per_request_sent(stub_server, google_books):
+    stub_server.script = [(503, {}, "")]
+    with pytest.raises(requests.HTTPError):
+        final_project.fetch_google_books("dune")
+    assert len(stub_server.requests) == final_project.GOOGLE_BOOKS_ATTEMPTS
+    assert google_books.used_today == len(stub_server.requests)